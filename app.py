@@ -1,29 +1,131 @@
-from flask import Flask, render_template, url_for, redirect, request, flash, make_response
+from flask import Flask, render_template, url_for, redirect, request, flash, make_response, send_file, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, login_user, LoginManager, login_required, logout_user, current_user
 from flask_wtf import FlaskForm
-from flask_weasyprint import HTML, render_pdf
+from flask_weasyprint import HTML
 from wtforms import StringField, PasswordField, SubmitField, SelectField, IntegerField
 from wtforms.validators import InputRequired, Length, ValidationError
+from werkzeug.utils import secure_filename
+from sqlalchemy.exc import IntegrityError
 from flask_bcrypt import Bcrypt
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import repeat
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import datetime
+import click
+import io
+import hashlib
 import json
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import bulk_io
+import change_sub_pdf_gen
+import config
+import metrics
+import notifications
+import sbert_similarity
+from pdf_cache import PdfCache
+from pdf_export import ordered_map, render_pdf, stream_zip
+from query_cache import QueryCache
 
 app = Flask(__name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
-app.config['SECRET_KEY'] = 'my_secret_key'
-app.config['SQLALCHEMY_ECHO'] = True
+config.load(app)
 
 db = SQLAlchemy(app)
+with app.app_context():
+    config.install_sqlite_pragmas(db.engine)
+    metrics.init_app(app, db.engine)
+    # The FAQ lives in the same database, shared by every node
+    sbert_similarity.use_database(db.engine.url.render_as_string(hide_password=False))
 bcrypt = Bcrypt(app)
+# bcrypt releases the GIL, so these threads hash in parallel while the
+# pool's size keeps logins from taking every core from other requests
+password_pool = ThreadPoolExecutor(max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                                   thread_name_prefix='password-hash')
+pdf_cache = PdfCache(app.config['PDF_CACHE_DIR'])
+# Detached copies of recently seen users, with their student/employee row
+user_cache = QueryCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+metrics.REGISTRY.add_cache('pdf', pdf_cache)
+metrics.REGISTRY.add_cache('user', user_cache)
+
+
+def template_version(name):
+    # Part of the PDF cache key, so editing a template invalidates its PDFs
+    with open(os.path.join(app.root_path, app.template_folder, name), 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()[:16]
+
+GRADES_PDF_VERSION = template_version('grades_pdf.html')
+# Answer of an open question whose employee was deleted when nobody else had room for it
+UNASSIGNED_QUESTION_ANSWER = "The employee handling this question has left. Please ask it again."
 
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+def hash_password(password):
+    """
+    Hashes `password` at BCRYPT_LOG_ROUNDS on the password pool.
+    """
+    return password_pool.submit(bcrypt.generate_password_hash, password).result().decode('utf-8')
+
+def password_cost(password_hash):
+    # "$2b$12$<salt and hash>" -> 12
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+def check_password(user, password):
+    """
+    Checks `password` against the user's stored hash on the password pool.
+
+    When it matches but the hash was made at another cost than
+    BCRYPT_LOG_ROUNDS, the password is hashed again at the current cost;
+    the caller commits the new hash.
+    """
+    stored = user.password
+    # Hashes from before hash_password() were stored as bytes
+    if isinstance(stored, bytes):
+        stored = stored.decode('utf-8')
+    if not password_pool.submit(bcrypt.check_password_hash, stored, password).result():
+        return False
+    if password_cost(stored) != app.config['BCRYPT_LOG_ROUNDS']:
+        user.password = hash_password(password)
+    return True
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    """
+    Loads the logged-in user with its student/employee row in one query,
+    and reuses that copy for USER_CACHE_TTL seconds so most requests only
+    check, by primary key, that the user still exists.
+
+    The cache belongs to one process, so a user deleted through another
+    worker may still be cached here; the check logs them out.
+
+    The cached copy is never attached to a session; each request merges it
+    in without loading, and only relationships it touches are queried.
+    Fields that change after registration (Employee.open_questions and
+    last_assigned_at) are deferred, so they are never served from here.
+    """
+    user = user_cache.get(user_id)
+    if user is not None and db.session.scalar(db.select(User.id).filter_by(id=user.id)) is None:
+        user_cache.discard(user_id)
+        return None
+    if user is None:
+        user = db.session.get(User, int(user_id))
+        if user is None:
+            return None
+        # Cascades to the student/employee row
+        db.session.expunge(user)
+        user_cache.put(user_id, user)
+    return db.session.merge(user, load=False)
 
 
 class User(db.Model, UserMixin):
@@ -32,11 +134,14 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(80), nullable=False)
     role = db.Column(db.String(20), nullable=False)
 
-    # Relationship to link with the Student table
-    student = db.relationship('Student', back_populates='user', uselist=False)
+    # Relationship to link with the Student table. Loaded with the user,
+    # nearly every page needs it
+    student = db.relationship('Student', back_populates='user', uselist=False, lazy='joined',
+                              cascade='all, delete-orphan')
 
     # Relationship to Employee
-    employee = db.relationship('Employee', back_populates='user', uselist=False)
+    employee = db.relationship('Employee', back_populates='user', uselist=False, lazy='joined',
+                               cascade='all, delete-orphan')
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -44,51 +149,252 @@ class Student(db.Model):
 
     name = db.Column(db.String(100), nullable=False)
     address = db.Column(db.String(200), nullable=False)
-    courses = db.Column(db.Text, nullable=True) # Store as JSON or comma-separated values
-    grades = db.Column(db.Text, nullable=True)  # Store as JSON or other formats
-    group = db.Column(db.Text, nullable=True)   # Student group. 311CA 322CC 432CB
+    # Legacy JSON lists, moved into Enrollment / Grade by `flask migrate-courses`
+    courses_json = db.Column('courses', db.Text, nullable=True)
+    grades_json = db.Column('grades', db.Text, nullable=True)
+    group = db.Column(db.Text, nullable=True, index=True)   # Student group. 311CA 322CC 432CB
 
     # Relationship to User
     user = db.relationship('User', back_populates='student')
 
+    enrollments = db.relationship('Enrollment', back_populates='student', order_by='Enrollment.id',
+                                  cascade='all, delete-orphan')
+    grade_entries = db.relationship('Grade', back_populates='student', order_by='Grade.id',
+                                    cascade='all, delete-orphan')
+    questions = db.relationship('Question', back_populates='student', cascade='all, delete-orphan')
+    subject_change_requests = db.relationship('SubjectChangeRequest', back_populates='student',
+                                              order_by='SubjectChangeRequest.id.desc()',
+                                              cascade='all, delete-orphan')
+
+    @property
+    def courses(self):
+        # Same "course - teacher" strings the JSON column used to hold
+        return [f"{e.course.name} - {e.course.teacher}" for e in self.enrollments]
+
+    @property
+    def grades(self):
+        return [f"{g.course.name} - {g.course.teacher} - Grade: {g.value}" for g in self.grade_entries]
+
     def enroll_in_course(self, course_name, teacher_name):
         # Add a new course to the list of courses
-        course_entry = f"{course_name} - {teacher_name}"
-        courses_list = json.loads(self.courses) if self.courses else []
-        if course_entry not in courses_list:
-            courses_list.append(course_entry)
-        self.courses = json.dumps(courses_list)
+        course = Course.get_or_create(course_name, teacher_name)
+        exists = db.session.query(Enrollment.id).filter_by(student_id=self.id, course_id=course.id).first()
+        if not exists:
+            # By id: an object in the student's collection would be flushed
+            # before the savepoint starts
+            insert_unless_exists(Enrollment(student_id=self.id, course_id=course.id))
+            db.session.expire(self, ['enrollments'])
 
     def grade_student(self, course_name, teacher_name, course_grade):
-        entry = f"{course_name} - {teacher_name} - Grade: {course_grade}"
-        grades_list = json.loads(self.grades) if self.grades else []
-        if entry not in grades_list:
-            grades_list.append(entry)
-        self.grades = json.dumps(grades_list)
+        # Returns whether a grade was added; the caller reclaims the
+        # student's cached reports once it committed
+        course = Course.get_or_create(course_name, teacher_name)
+        exists = db.session.query(Grade.id).filter_by(student_id=self.id, course_id=course.id,
+                                                      value=course_grade).first()
+        if exists:
+            return False
+        added = insert_unless_exists(Grade(student_id=self.id, course_id=course.id, value=course_grade))
+        db.session.expire(self, ['grade_entries'])
+        return added
+
+    def release_open_questions(self):
+        # Give back the slots the student's unanswered questions hold, in
+        # one UPDATE, before the questions are deleted with the student
+        open_questions = (db.select(db.func.count(Question.id))
+                          .where(Question.employee_id == Employee.id, Question.student_id == self.id,
+                                 Question.status == 'open')
+                          .scalar_subquery())
+        db.session.execute(
+            db.update(Employee)
+            .where(Employee.id.in_(db.select(Question.employee_id)
+                                   .where(Question.student_id == self.id, Question.status == 'open')))
+            .values(open_questions=Employee.open_questions - open_questions)
+        )
+
+def insert_unless_exists(row):
+    """
+    Inserts `row` in a savepoint. When a unique constraint says another
+    request inserted the same row first, only the savepoint is rolled back.
+
+    Returns:
+        bool: Whether `row` was inserted.
+    """
+    try:
+        with db.session.begin_nested():
+            db.session.add(row)
+    except IntegrityError:
+        return False
+    return True
+
+class Course(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    teacher = db.Column(db.String(100), nullable=False)
 
-class Employee(db.Model):
+    __table_args__ = (db.UniqueConstraint('name', 'teacher'),)
+
+    enrollments = db.relationship('Enrollment', back_populates='course')
+    students = db.relationship('Student', secondary='enrollment', viewonly=True)
+
+    @staticmethod
+    def get_or_create(name, teacher):
+        course = Course.query.filter_by(name=name, teacher=teacher).first()
+        if course is None:
+            course = Course(name=name, teacher=teacher)
+            if not insert_unless_exists(course):
+                # Another request created it in the meantime
+                course = Course.query.filter_by(name=name, teacher=teacher).one()
+        return course
+
+    @staticmethod
+    def average_grades():
+        # (course, average grade) for every graded course, in one query
+        return db.session.query(Course, db.func.avg(Grade.value)).join(Grade).group_by(Course.id).all()
+
+class Enrollment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
 
-    # Relationship to User
-    user = db.relationship('User', back_populates='employee')
+    # Also serves lookups by student_id alone
+    __table_args__ = (db.UniqueConstraint('student_id', 'course_id'),)
+
+    student = db.relationship('Student', back_populates='enrollments')
+    course = db.relationship('Course', back_populates='enrollments', lazy='joined')
 
-    # Store questions as JSON (for flexibility)
-    questions = db.Column(db.Text, nullable=True)  # JSON format
+class Grade(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False, index=True)
+    value = db.Column(db.Integer, nullable=False)
 
-    def set_questions(self, question_list):
-        # Set the questions for the employee.
-        self.questions = json.dumps(question_list)
+    __table_args__ = (db.UniqueConstraint('student_id', 'course_id', 'value'),)
 
-    def get_questions(self):
-        # Get the list of questions.
-        return json.loads(self.questions) if self.questions else []
+    student = db.relationship('Student', back_populates='grade_entries')
+    course = db.relationship('Course', lazy='joined')
 
-    def add_question(self, question_text, student_id):
-        question_entry = f"{question_text} - {student_id}"
-        questions_list = json.loads(self.questions) if self.questions else []
-        questions_list.append(question_entry)
-        self.set_questions(questions_list)
+class Employee(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    # Relationship to User, the username is shown wherever the employee is
+    user = db.relationship('User', back_populates='employee', lazy='joined')
+
+    # Legacy JSON list of "question - student user id", moved into Question
+    # rows by `flask migrate-questions`
+    questions_json = db.Column('questions', db.Text, nullable=True)
+
+    # Kept in step with the Question rows so assignment doesn't count them
+    # Deferred so a cached user never carries a stale count
+    open_questions = db.deferred(db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True))
+    last_assigned_at = db.deferred(db.Column(db.DateTime, nullable=True, index=True))
+
+    questions = db.relationship('Question', back_populates='employee', order_by='Question.id')
+
+    @staticmethod
+    def assign_question(question_text, student):
+        """
+        Assigns a new question to an employee with room for it.
+
+        The employee is picked and its open-question count bumped by a
+        single UPDATE, so two students asking at once can't both take the
+        last free slot.
+
+        Returns:
+            Question: The new question, or None if every employee is at
+            MAX_OPEN_QUESTIONS.
+        """
+        employee_id = Employee.take_slot()
+        if employee_id is None:
+            return None
+
+        question = Question(text=question_text, student_id=student.id, employee_id=employee_id)
+        db.session.add(question)
+        return question
+
+    @staticmethod
+    def take_slot(exclude=None):
+        """
+        Picks the next employee by QUESTION_ASSIGNMENT and bumps its
+        open-question count, in one UPDATE.
+
+        Returns:
+            int: Id of the employee, or None if every employee (other than
+            `exclude`) is at MAX_OPEN_QUESTIONS.
+        """
+        cap = app.config['MAX_OPEN_QUESTIONS']
+        if app.config['QUESTION_ASSIGNMENT'] == 'round_robin':
+            order = (Employee.last_assigned_at.asc().nulls_first(), Employee.id)
+        else:
+            order = (Employee.open_questions, Employee.id)
+
+        candidates = db.select(Employee.id).where(Employee.open_questions < cap)
+        if exclude is not None:
+            candidates = candidates.where(Employee.id != exclude)
+        candidate = candidates.order_by(*order).limit(1).scalar_subquery()
+        return db.session.execute(
+            db.update(Employee)
+            .where(Employee.id == candidate, Employee.open_questions < cap)
+            .values(open_questions=Employee.open_questions + 1, last_assigned_at=datetime.utcnow())
+            .returning(Employee.id)
+        ).scalar()
+
+    def hand_over_open_questions(self):
+        """
+        Moves this employee's open questions to other employees with room,
+        oldest first, before the employee is deleted. Questions nobody has
+        room for are closed with a note asking the student to ask again.
+        """
+        open_questions = (Question.query.filter_by(employee_id=self.id, status='open')
+                          .order_by(Question.created_at, Question.id).all())
+        for question in open_questions:
+            employee_id = Employee.take_slot(exclude=self.id)
+            if employee_id is None:
+                question.status = 'closed'
+                question.answer = UNASSIGNED_QUESTION_ANSWER
+                question.answered_at = datetime.utcnow()
+            else:
+                question.employee_id = employee_id
+        db.session.flush()
+        # Deleting the employee unassigns whatever is still in the list
+        db.session.expire(self, ['questions'])
+
+class Question(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False)
+    employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='open')   # open / answered / closed
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    answer = db.Column(db.Text, nullable=True)
+    answered_at = db.Column(db.DateTime, nullable=True)
+
+    # Back the keyset-paginated employee queue and student inbox
+    __table_args__ = (
+        db.Index('ix_question_employee_queue', 'employee_id', 'status', 'created_at', 'id'),
+        db.Index('ix_question_student_inbox', 'student_id', 'answered_at', 'id'),
+    )
+
+    student = db.relationship('Student', back_populates='questions')
+    employee = db.relationship('Employee', back_populates='questions')
+
+class SubjectChangeRequest(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    old_subject = db.Column(db.String(100), nullable=False)
+    new_subject = db.Column(db.String(100), nullable=False)
+    new_teacher = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / ready / refused / failed
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+
+    student = db.relationship('Student', back_populates='subject_change_requests')
+
+    @property
+    def path(self):
+        # One file per request, so students never overwrite each other's
+        return os.path.join(app.config['DOCUMENTS_DIR'], str(self.student_id), f"subject-change-{self.id}.pdf")
 
 class RegisterForm(FlaskForm):
     username = StringField(validators=[
@@ -140,6 +446,13 @@ class GradeStudentForm(FlaskForm):
     grade = IntegerField(validators=[InputRequired()], render_kw={"placeholder": "Grade"})
     submit = SubmitField("Add Grade")
 
+# Student form for requesting a subject change
+class SubjectChangeForm(FlaskForm):
+    old_subject = SelectField('Current subject', validators=[InputRequired()])
+    new_subject = StringField(validators=[InputRequired(), Length(max=100)], render_kw={"placeholder": "New Subject"})
+    new_teacher = StringField(validators=[InputRequired(), Length(max=100)], render_kw={"placeholder": "New Teacher"})
+    submit = SubmitField("Request")
+
 @app.route('/')
 def home():
     return render_template('home.html')
@@ -152,7 +465,9 @@ def login():
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
         if user:
-            if bcrypt.check_password_hash(user.password, form.password.data):
+            if check_password(user, form.password.data):
+                # Saves the password if it was rehashed
+                db.session.commit()
                 login_user(user)
                 if user.role == 'student':
                     return redirect(url_for('dashboard'))
@@ -168,6 +483,7 @@ def login():
 @app.route('/logout', methods=['GET', 'POST'])
 @login_required
 def logout():
+    user_cache.discard(str(current_user.id))
     logout_user()
     return redirect(url_for('login'))
 
@@ -186,27 +502,93 @@ def ask_question():
         return redirect(url_for('home'))
 
     question = request.form.get('question')
-    student_id = current_user.id
 
     if not question:
         flash("Please provide a valid question.")
         return redirect(url_for('dashboard'))
 
-    # Find the first employee with fewer than 5 questions
-    employees = Employee.query.all()
-    for emp in employees:
-        if emp.questions is None:  # Initialize if it's None
-            emp.questions = "[]"
+    start_faq_jobs()
+    # Try the FAQ first; the question is encoded by the background
+    # embedding service, batched with other students' questions
+    try:
+        answer, score = sbert_similarity.faq_answer(question)
+    except (queue.Full, FutureTimeoutError):
+        # Still loading or too busy, an employee answers instead
+        app.logger.info("FAQ lookup unavailable, forwarding the question to an employee")
+        answer = None
+    except Exception:
+        app.logger.exception("FAQ lookup failed, forwarding the question to an employee")
+        answer = None
+    if answer:
+        flash(f"Answer from the FAQ: {answer}")
+        return redirect(url_for('dashboard'))
 
-        if len(emp.get_questions()) < 5:
-            emp.add_question(question, student_id)
-            db.session.commit()
-            flash(f"Your question has been assigned to {emp.user.username}.")
-            return redirect(url_for('dashboard'))
+    # Hand the question to an employee with room for it
+    new_question = Employee.assign_question(question, current_user.student)
+    if new_question is None:
+        db.session.rollback()
+        flash("All employees currently have the maximum number of questions.")
+        return redirect(url_for('dashboard'))
 
-    flash("All employees currently have the maximum number of questions.")
+    db.session.commit()
+    flash(f"Your question has been assigned to {new_question.employee.user.username}.")
     return redirect(url_for('dashboard'))
 
+def start_faq_jobs():
+    # Started by the first request that uses the FAQ, so CLI commands and
+    # a pre-fork master don't run the thread
+    if app.config['FAQ_JOBS_INTERVAL']:
+        sbert_similarity.start_faq_jobs(app.config['FAQ_JOBS_INTERVAL'])
+
+@app.route('/faq/search', methods=['GET'])
+@login_required
+def faq_search():
+    question = request.args.get('q', '').strip()
+    if not question:
+        return {"error": "Missing question (?q=)"}, 400
+    top_k = min(request.args.get('top_k', 3, type=int), app.config['FAQ_SEARCH_MAX_RESULTS'])
+
+    start_faq_jobs()
+    try:
+        matches = sbert_similarity.faq_search(question, top_k=top_k)
+    except (queue.Full, FutureTimeoutError):
+        return {"error": "The FAQ search is busy, try again"}, 503
+    return {"question": question, "matches": matches}
+
+def keyset_page(query, sort_column, cursor, descending=False):
+    """
+    Returns one page of `query` ordered by (sort_column, id), starting after
+    `cursor`, plus the cursor of the next page (None on the last page).
+
+    Seeking past the last row seen keeps every page an index range scan,
+    however deep into the list it is, unlike OFFSET.
+    """
+    model = sort_column.class_
+    key = db.tuple_(sort_column, model.id)
+    position = None
+    if cursor:
+        timestamp, _, last_id = cursor.partition('_')
+        try:
+            position = (datetime.fromisoformat(timestamp), int(last_id))
+        except ValueError:
+            # A mangled link, start over from the first page
+            position = None
+    if position is not None:
+        query = query.filter(key < position if descending else key > position)
+    if descending:
+        query = query.order_by(sort_column.desc(), model.id.desc())
+    else:
+        query = query.order_by(sort_column, model.id)
+
+    per_page = app.config['PAGE_SIZE']
+    items = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        last = items[-1]
+        next_cursor = f"{getattr(last, sort_column.key).isoformat()}_{last.id}"
+    return items, next_cursor
+
 @app.route('/answer_question', methods=['POST'])
 @login_required
 def answer_question():
@@ -214,23 +596,52 @@ def answer_question():
         flash("You must be an employee!")
         return redirect(url_for('home'))
 
-    recipient_id = request.form['recipient_id']
+    question_id = request.form['question_id']
     answer = request.form['answer']
 
-    # Find the student based on the recipient_id
-    student = Student.query.filter_by(id=recipient_id).first()
-
-    if student:
-        # You can store the answer in a list or a new field, for example:
-        student_answer = f"Answer for student {recipient_id}: {answer}"
-
-        # For now, you could print it or store it as part of the answer record
-        print(student_answer)  # Or save it somewhere appropriate
+    # Only the employee the question was assigned to can answer it
+    question = Question.query.filter_by(id=question_id, employee_id=current_user.employee.id,
+                                        status='open').first()
+
+    answered_at = datetime.utcnow()
+    closed = False
+    if question:
+        # Only the request that actually closes the question frees the
+        # employee's slot; the same answer submitted twice at once must
+        # not free two
+        closed = db.session.execute(
+            db.update(Question)
+            .where(Question.id == question.id, Question.status == 'open')
+            .values(answer=answer, status='answered', answered_at=answered_at)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+
+    if closed:
+        db.session.execute(
+            db.update(Employee)
+            .where(Employee.id == question.employee_id)
+            .values(open_questions=Employee.open_questions - 1)
+        )
+        db.session.commit()
+        notify_student(question.student_id, 'answer', {
+            "question_id": question.id,
+            "question": question.text,
+            "answer": answer,
+            "answered_at": answered_at.isoformat(),
+        })
+
+        # The FAQ couldn't answer it; the FAQ job merges it with similar
+        # questions and promotes it once it has been asked often enough
+        start_faq_jobs()
+        try:
+            sbert_similarity.add_rejected_question(question.text, answer)
+        except Exception:
+            app.logger.exception("Could not record question %s for the FAQ", question.id)
 
         flash('Answer sent successfully.')
         return redirect(url_for('employee_dashborad'))
     else:
-        flash('Student not found.')
+        flash('Question not found.')
         return redirect(url_for('employee_dashborad'))
 
 @app.route('/employee_dashborad', methods=['GET', 'POST'])
@@ -249,10 +660,88 @@ def employee_dashborad():
         flash("Employee entry not found!")
         return redirect(url_for('home'))
 
-    # Get the questions (we assume the `questions` are stored in JSON format)
-    questions = json.loads(employee.questions) if employee.questions else []
+    # Oldest open questions first
+    questions, next_cursor = keyset_page(
+        Question.query.filter_by(employee_id=employee.id, status='open'),
+        Question.created_at, request.args.get('after'))
+
+    return render_template('employee_dashborad.html', username=username, questions=questions,
+                           next_cursor=next_cursor)
 
-    return render_template('employee_dashborad.html', username=username, questions=questions)
+@app.route('/inbox')
+@login_required
+def inbox():
+    if current_user.role != 'student':
+        return redirect(url_for('home'))
+
+    # Newest answers first
+    answers, next_cursor = keyset_page(
+        Question.query.filter(Question.student_id == current_user.student.id, Question.answered_at.isnot(None)),
+        Question.answered_at, request.args.get('before'), descending=True)
+
+    return render_template('inbox.html', answers=answers, next_cursor=next_cursor)
+
+_notification_broker = None
+
+def get_notification_broker():
+    # Created on first use, so a forking server creates one per worker
+    global _notification_broker
+    if _notification_broker is None:
+        options = {}
+        if app.config['NOTIFICATION_BROKER'] == notifications.LocalBroker.name:
+            options['directory'] = app.config['NOTIFICATION_DIR']
+        _notification_broker = notifications.make_broker(app.config['NOTIFICATION_BROKER'], **options)
+    return _notification_broker
+
+def close_notification_broker():
+    """
+    Ends the open notification streams, e.g. before a worker shuts down.
+    """
+    if _notification_broker is not None:
+        _notification_broker.close()
+
+def notify_student(student_id, event, data):
+    """
+    Pushes `event` to the notification streams of a student. Never raises:
+    the change it reports is already committed.
+    """
+    try:
+        user_id = db.session.scalar(db.select(Student.user_id).where(Student.id == student_id))
+        get_notification_broker().publish(f"user:{user_id}", {"event": event, "data": data})
+    except Exception:
+        app.logger.exception("Could not send a %s notification to student %s", event, student_id)
+
+@app.route('/notifications')
+@login_required
+def notification_stream():
+    """
+    Server-sent events for the logged-in user: `answer` when one of their
+    questions is answered, `document` when a requested document is done.
+    The stream holds no database connection while it waits.
+    """
+    channel = f"user:{current_user.id}"
+    heartbeat = app.config['NOTIFICATION_HEARTBEAT']
+
+    def events():
+        subscription = get_notification_broker().subscribe(channel)
+        try:
+            # Reconnect after 5 s if the connection drops
+            yield "retry: 5000\n\n"
+            while not subscription.closed:
+                message = subscription.get(timeout=heartbeat)
+                if message is None:
+                    # Also how a client that went away is noticed
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+        finally:
+            subscription.close()
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Don't let a proxy buffer the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/admin_dashboard', methods=['GET', 'POST'])
 @login_required
@@ -261,42 +750,45 @@ def admin_dashboard():
         flash("You must be an admin!")
         return redirect(url_for('home'))
 
-    # Get all non-admin users (students and employees)
-    users_to_delete = User.query.filter(User.role != 'admin').all()
-
     if request.method == 'POST':
         user_id_to_delete = request.form['user_id_to_delete']
 
-        # Find the user by id
-        user_to_delete = User.query.get(user_id_to_delete)
+        # Find the user by id, its student/employee row comes with it
+        user_to_delete = db.session.get(User, int(user_id_to_delete))
 
         if user_to_delete:
-            if user_to_delete.role == 'student':
-                student = Student.query.filter_by(user_id=user_to_delete.id).first()
-                if student:
-                    db.session.delete(student)  # Delete the student's data
-            elif user_to_delete.role == 'employee':
-                employee = Employee.query.filter_by(user_id=user_to_delete.id).first()
-                if employee:
-                    db.session.delete(employee)  # Delete the employee's data
-
-            # Delete the user from the User table
+            if user_to_delete.student:
+                user_to_delete.student.release_open_questions()
+            if user_to_delete.employee:
+                user_to_delete.employee.hand_over_open_questions()
+            # Deletes the student's/employee's data too
             db.session.delete(user_to_delete)
             db.session.commit()
+            user_cache.discard(str(user_to_delete.id))
 
             flash(f'{user_to_delete.role.capitalize()} deleted successfully!')
 
         else:
             flash("User not found!")
 
-    return render_template('admin_dashboard.html', users=users_to_delete)
+    # One page of non-admin users (students and employees), by id
+    per_page = app.config['PAGE_SIZE']
+    after = request.args.get('after', 0, type=int)
+    users_to_delete = (User.query.filter(User.role != 'admin', User.id > after)
+                       .order_by(User.id).limit(per_page + 1).all())
+    next_cursor = None
+    if len(users_to_delete) > per_page:
+        users_to_delete = users_to_delete[:per_page]
+        next_cursor = users_to_delete[-1].id
+
+    return render_template('admin_dashboard.html', users=users_to_delete, next_cursor=next_cursor)
 
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     form = RegisterForm()
 
     if form.validate_on_submit():
-        hashed_password = bcrypt.generate_password_hash(form.password.data)
+        hashed_password = hash_password(form.password.data)
 
         # Create a User entry
         new_user = User(username=form.username.data, password=hashed_password, role=form.role.data)
@@ -310,9 +802,7 @@ def register():
                 user_id=new_user.id,
                 name=form.name.data,
                 address=form.address.data,
-                group=form.group.data,
-                courses="[]",   # Placeholder for courses
-                grades="[]"     # Placeholder for grades
+                group=form.group.data
             )
 
             # Add the new student
@@ -323,8 +813,7 @@ def register():
         elif form.role.data == 'employee':
             # Create a new employee
             new_employee = Employee(
-                user_id=new_user.id,
-                questions="[]"  # Initialize with an empty list for questions
+                user_id=new_user.id
             )
             db.session.add(new_employee)
             db.session.commit()
@@ -408,8 +897,11 @@ def grade_student():
             flash("Student not found!")
             return redirect(url_for('grade_student'))
 
-        student.grade_student(form.course_name.data, form.teacher_name.data, form.grade.data)
+        added = student.grade_student(form.course_name.data, form.teacher_name.data, form.grade.data)
         db.session.commit()
+        if added:
+            # Only reports of the grades before this one
+            pdf_cache.invalidate(student.id, keep=grades_pdf_key(student))
         flash(f"Grade {form.grade.data} added for student {student.id} in {form.course_name.data}!")
         return redirect(url_for('grade_student'))
 
@@ -422,26 +914,611 @@ def generate_pdf():
         flash("Unauthorized access!")
         return redirect(url_for('home'))
 
-    # Retrieve student grades
     student = current_user.student
-    grades_list = json.loads(student.grades) if student.grades else []
+    key = grades_pdf_key(student)
+
+    # The browser's copy is still current, skip rendering and sending it
+    if key in request.if_none_match:
+        response = make_response('', 304)
+        response.set_etag(key)
+        return response
+
+    try:
+        file = open(grades_pdf(student, key), 'rb')
+    except FileNotFoundError:
+        # Reclaimed since the lookup, when a grade was added meanwhile
+        file = open(grades_pdf(student, key), 'rb')
+    return send_file(file, mimetype='application/pdf', download_name='grades.pdf',
+                     etag=key, conditional=True, max_age=0)
+
+def grades_pdf_key(student):
+    return PdfCache.key(GRADES_PDF_VERSION, student.name, student.group, student.grades)
+
+def grades_pdf(student, key=None):
+    """
+    Returns the path of the student's grade report, rendering it with
+    WeasyPrint only when no PDF for the same data and template is cached.
+    """
+    key = key or grades_pdf_key(student)
+    path = pdf_cache.get(student.id, key)
+    if path is None:
+        # Render the HTML template for the PDF
+        rendered_html = render_template('grades_pdf.html', grades=student.grades, student=student)
+        data, seconds = metrics.timed_call(HTML(string=rendered_html).write_pdf)
+        metrics.PDF_RENDER_SECONDS.observe(seconds, document='grades')
+        path = pdf_cache.put(student.id, key, data)
+    return path
+
+_export_pool = None
+
+def get_export_pool():
+    # Spawned rather than forked: the parent runs background threads
+    global _export_pool
+    if _export_pool is None:
+        _export_pool = ProcessPoolExecutor(max_workers=app.config['PDF_EXPORT_WORKERS'],
+                                           mp_context=multiprocessing.get_context('spawn'))
+    return _export_pool
+
+def group_report_pdfs(group, progress=None):
+    """
+    Yields (file name, PDF bytes) for the grade report of every student in
+    `group`. Cached reports are read from disk, the rest are rendered
+    across the export process pool with a bounded number in flight.
+
+    Args:
+        progress (callable): Called as progress(done, total) after each report.
+    """
+    students = (Student.query.filter_by(group=group)
+                .options(db.selectinload(Student.grade_entries))
+                .order_by(Student.id).all())
+    total = len(students)
+    done = 0
+
+    def file_name(student):
+        return f"{student.id}-{secure_filename(student.name) or 'student'}.pdf"
+
+    missing = []
+    for student in students:
+        key = grades_pdf_key(student)
+        path = pdf_cache.get(student.id, key)
+        data = None
+        if path is not None:
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                # Reclaimed since the lookup, when a grade was added meanwhile
+                pass
+        if data is None:
+            missing.append((student, key))
+            continue
+        done += 1
+        if progress:
+            progress(done, total)
+        yield file_name(student), data
+
+    def jobs():
+        for student, key in missing:
+            yield (student, key), render_template('grades_pdf.html', grades=student.grades, student=student)
+
+    workers = app.config['PDF_EXPORT_WORKERS']
+    render = partial(metrics.timed_call, render_pdf)
+    for (student, key), (data, seconds) in ordered_map(get_export_pool(), render, jobs(), window=2 * workers):
+        metrics.PDF_RENDER_SECONDS.observe(seconds, document='grades')
+        pdf_cache.put(student.id, key, data)
+        done += 1
+        if progress:
+            progress(done, total)
+        yield file_name(student), data
+
+@app.route('/export_group', methods=['GET'])
+@login_required
+def export_group():
+    if current_user.role not in ('employee', 'admin'):
+        flash("Unauthorized access!")
+        return redirect(url_for('home'))
 
-    # Render the HTML template for the PDF
-    rendered_html = render_template('grades_pdf.html', grades=grades_list, student=student)
+    group = request.args.get('group', '').strip()
+    total = Student.query.filter_by(group=group).count() if group else 0
+    if not total:
+        flash(f"No students found in group {group}!")
+        return redirect(request.referrer or url_for('home'))
+
+    def progress(done, total):
+        if done % 50 == 0 or done == total:
+            app.logger.info("Exporting group %s: %d/%d reports", group, done, total)
+
+    response = Response(stream_with_context(stream_zip(group_report_pdfs(group, progress))),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=transcripts-{secure_filename(group)}.zip'
+    # Lets clients show progress while the archive streams in
+    response.headers['X-Export-Count'] = str(total)
+    return response
+
+@app.cli.command('export-group')
+@click.argument('group')
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+def export_group_command(group, output):
+    """Write the grade reports of every student in GROUP to the ZIP file OUTPUT."""
+    start = time.perf_counter()
+
+    def progress(done, total):
+        elapsed = time.perf_counter() - start
+        print(f"\r{done}/{total} reports ({done / elapsed:.1f}/s)", end='', file=sys.stderr, flush=True)
+
+    with open(output, 'wb') as file:
+        for chunk in stream_zip(group_report_pdfs(group, progress)):
+            file.write(chunk)
+    print(f"\nWrote {output}", file=sys.stderr)
+
+
+_document_pool = None
+
+def get_document_pool():
+    # Kept apart from the export pool so a large export can't hold up
+    # the forms students are waiting for
+    global _document_pool
+    if _document_pool is None:
+        _document_pool = ProcessPoolExecutor(max_workers=app.config['DOCUMENT_WORKERS'],
+                                             mp_context=multiprocessing.get_context('spawn'))
+    return _document_pool
+
+def enrolled_subjects(student):
+    # Names of the courses the student is enrolled in, straight from the join
+    rows = (db.session.query(Course.name).join(Enrollment)
+            .filter(Enrollment.student_id == student.id).all())
+    return {name for name, in rows}
+
+def queue_subject_change(change, student):
+    """
+    Hands a committed SubjectChangeRequest to the document pool. Its status
+    is updated once the worker has written the PDF, or to 'failed' when the
+    pool doesn't take the job.
+    """
+    global _document_pool
+    first_name, _, last_name = student.name.partition(' ')
+    values = {
+        "student_first_name": first_name,
+        "student_last_name": last_name,
+        "student_addr": student.address,
+        "student_group": student.group or '',
+        "subject_list": enrolled_subjects(student),
+        "old_subject": change.old_subject,
+        "new_subject": change.new_subject,
+        "new_teacher": change.new_teacher,
+    }
+    os.makedirs(os.path.dirname(change.path), exist_ok=True)
+    try:
+        future = get_document_pool().submit(metrics.timed_call, change_sub_pdf_gen.fill_named_form, change.path,
+                                            change_sub_pdf_gen.SUBJECT_CHANGE.name, values, student.id)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            # A broken pool refuses every job; the next request gets a new one
+            _document_pool = None
+        # Fails the request right away, through the same callback
+        future = Future()
+        future.set_exception(e)
+    future.add_done_callback(partial(finish_subject_change, change.id,
+                                     url_for('subject_change_pdf', change_id=change.id)))
+
+def finish_subject_change(change_id, download_url, future):
+    # Runs on the pool's result thread, or on the request's when the job
+    # couldn't be submitted, in an app context of its own
+    with app.app_context():
+        change = db.session.get(SubjectChangeRequest, change_id)
+        if change is None:
+            return
+        try:
+            error, seconds = future.result()
+        except Exception as e:
+            app.logger.exception("Subject change request %d failed", change_id)
+            change.status, change.error = 'failed', str(e)
+        else:
+            metrics.PDF_RENDER_SECONDS.observe(seconds, document='subject_change')
+            change.status = 'refused' if error else 'ready'
+            change.error = error
+        change.completed_at = datetime.utcnow()
+        db.session.commit()
 
-    # Generate the PDF
-    pdf = render_pdf(HTML(string=rendered_html))
+        status = {"document": "subject_change", "id": change.id, "status": change.status, "error": change.error}
+        if change.status == 'ready':
+            status["download_url"] = download_url
+        notify_student(change.student_id, 'document', status)
+
+def fail_interrupted_subject_changes():
+    """
+    Marks requests still pending as failed. Their jobs died with the
+    process that queued them, so this runs when the server starts, before
+    any worker queues new ones.
+    """
+    interrupted = (db.update(SubjectChangeRequest)
+                   .where(SubjectChangeRequest.status == 'pending')
+                   .values(status='failed', completed_at=datetime.utcnow(),
+                           error="The server restarted before the document was ready. Please submit the request again."))
+    count = db.session.execute(interrupted).rowcount
+    db.session.commit()
+    if count:
+        app.logger.warning("Marked %d interrupted subject change requests as failed", count)
 
-    # Return the PDF as a response
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'inline; filename=grades.pdf'
+@app.route('/subject_change', methods=['GET', 'POST'])
+@login_required
+def subject_change():
+    if current_user.role != 'student':
+        flash("Unauthorized access!")
+        return redirect(url_for('home'))
+
+    student = current_user.student
+    form = SubjectChangeForm()
+    form.old_subject.choices = sorted(enrolled_subjects(student))
+
+    if form.validate_on_submit():
+        change = SubjectChangeRequest(student=student, old_subject=form.old_subject.data,
+                                      new_subject=form.new_subject.data, new_teacher=form.new_teacher.data)
+        db.session.add(change)
+        db.session.commit()
+        queue_subject_change(change, student)
+        flash("Your request is being generated.")
+        return redirect(url_for('subject_change'))
+
+    return render_template('subject_change.html', form=form, requests=student.subject_change_requests)
+
+def student_subject_change(change_id):
+    return SubjectChangeRequest.query.filter_by(id=change_id, student_id=current_user.student.id).first_or_404()
+
+@app.route('/subject_change/<int:change_id>')
+@login_required
+def subject_change_status(change_id):
+    if current_user.role != 'student':
+        return {"error": "Unauthorized access!"}, 403
+
+    change = student_subject_change(change_id)
+    status = {"id": change.id, "status": change.status, "error": change.error}
+    if change.status == 'ready':
+        status["download_url"] = url_for('subject_change_pdf', change_id=change.id)
+    return status
+
+@app.route('/subject_change/<int:change_id>/pdf')
+@login_required
+def subject_change_pdf(change_id):
+    if current_user.role != 'student':
+        flash("Unauthorized access!")
+        return redirect(url_for('home'))
+
+    change = student_subject_change(change_id)
+    if change.status != 'ready':
+        flash("This request is not ready yet.")
+        return redirect(url_for('subject_change'))
+    return send_file(change.path, mimetype='application/pdf', download_name='Cerere schimbare materie.pdf',
+                     conditional=True)
+
+
+_hash_pool = None
+
+def get_hash_pool():
+    global _hash_pool
+    if _hash_pool is None:
+        _hash_pool = ProcessPoolExecutor(max_workers=app.config['IMPORT_HASH_WORKERS'],
+                                         mp_context=multiprocessing.get_context('spawn'))
+    return _hash_pool
+
+def clean_record(kind, record):
+    """
+    Returns the fields of an imported record, stripped.
+
+    Raises:
+        ValueError: If a required field is missing or invalid.
+    """
+    if not isinstance(record, dict):
+        raise ValueError("not a JSON object")
+    values = {}
+    for field in bulk_io.FIELDS[kind]:
+        value = record.get(field)
+        value = '' if value is None else str(value).strip()
+        if not value and field not in bulk_io.OPTIONAL_FIELDS:
+            raise ValueError(f"missing {field}")
+        values[field] = value
+    # Same limits as the registration form
+    if not 4 <= len(values['username']) <= 20:
+        raise ValueError("username must be 4 to 20 characters")
+    if kind == 'students' and len(values['password']) < 8:
+        raise ValueError("password must be at least 8 characters")
+    if kind == 'grades':
+        values['grade'] = int(values['grade'])
+    return values
+
+def student_ids(usernames):
+    # username -> student id, in one query
+    rows = db.session.execute(db.select(User.username, Student.id).join(Student.user)
+                              .where(User.username.in_(usernames)))
+    return dict(rows.all())
+
+def course_ids(pairs):
+    """
+    (name, teacher) -> course id for every pair, creating the missing
+    courses with one INSERT.
+    """
+    pairs = list(pairs)
+    rows = db.session.execute(db.select(Course.name, Course.teacher, Course.id)
+                              .where(db.tuple_(Course.name, Course.teacher).in_(pairs)))
+    ids = {(name, teacher): course_id for name, teacher, course_id in rows}
+    missing = [{'name': name, 'teacher': teacher} for name, teacher in pairs if (name, teacher) not in ids]
+    if missing:
+        rows = db.session.execute(db.insert(Course).returning(Course.name, Course.teacher, Course.id), missing)
+        ids.update({(name, teacher): course_id for name, teacher, course_id in rows})
+    return ids
+
+def import_students(records, report):
+    usernames = [values['username'] for _, values in records]
+    taken = set(db.session.scalars(db.select(User.username).where(User.username.in_(usernames))))
+    new = []
+    for line, values in records:
+        if values['username'] in taken:
+            report.reject(line, f"username {values['username']} already exists")
+            continue
+        taken.add(values['username'])
+        new.append(values)
+    if not new:
+        return
+
+    # bcrypt is the slow part of an import, spread it over every core
+    workers = app.config['IMPORT_HASH_WORKERS']
+    hashes = get_hash_pool().map(bulk_io.hash_password, [values['password'] for values in new],
+                                 repeat(app.config['BCRYPT_LOG_ROUNDS']),
+                                 chunksize=max(1, len(new) // (4 * workers)))
+    users = db.session.execute(
+        db.insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{'username': values['username'], 'password': password_hash, 'role': 'student'}
+         for values, password_hash in zip(new, hashes)])
+    db.session.execute(db.insert(Student), [
+        {'user_id': user_id, 'name': values['name'], 'address': values['address'],
+         'group': values['group'] or None}
+        for values, user_id in zip(new, users.scalars())])
+    report.imported += len(new)
+
+def import_course_rows(model, records, report):
+    """
+    Inserts Enrollment or Grade rows for `records` with one statement,
+    skipping unknown students and rows that already exist.
+
+    Returns:
+        list: (student id, course id[, grade]) of the inserted rows.
+    """
+    graded = model is Grade
+    students = student_ids({values['username'] for _, values in records})
+    courses = course_ids({(values['course'], values['teacher']) for _, values in records})
+    columns = [model.student_id, model.course_id] + ([Grade.value] if graded else [])
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(*columns).where(model.student_id.in_(students.values())))}
+
+    new = []
+    for line, values in records:
+        student_id = students.get(values['username'])
+        if student_id is None:
+            report.reject(line, f"no student with username {values['username']}")
+            continue
+        row = (student_id, courses[values['course'], values['teacher']])
+        if graded:
+            row += (values['grade'],)
+        if row in existing:
+            report.skipped += 1
+            continue
+        existing.add(row)
+        new.append(row)
+
+    if new:
+        names = [column.key for column in columns]
+        db.session.execute(db.insert(model), [dict(zip(names, row)) for row in new])
+    report.imported += len(new)
+    return new
+
+def import_enrollments(records, report):
+    import_course_rows(Enrollment, records, report)
+
+def import_grades(records, report):
+    # Reclaim the space of the affected students' cached grade reports
+    for student_id in {row[0] for row in import_course_rows(Grade, records, report)}:
+        pdf_cache.invalidate(student_id)
+
+IMPORTERS = {'students': import_students, 'enrollments': import_enrollments, 'grades': import_grades}
+
+def bulk_import(kind, file, file_format, progress=None):
+    """
+    Imports students, enrollments or grades from a CSV/JSONL text stream.
+
+    Records are read and inserted IMPORT_CHUNK_SIZE at a time, one
+    transaction per chunk, so a large file is never held in memory and a
+    failure keeps the chunks before it. Invalid records and duplicates are
+    skipped and reported.
+
+    Args:
+        progress (callable): Called as progress(report, seconds) after each chunk.
+
+    Returns:
+        bulk_io.ImportReport: What was imported and skipped.
+    """
+    report = bulk_io.ImportReport()
+    importer = IMPORTERS[kind]
+    start = time.perf_counter()
+
+    def valid_records():
+        for line, record in enumerate(bulk_io.read_records(file, file_format), 1):
+            report.read += 1
+            try:
+                yield line, clean_record(kind, record)
+            except ValueError as e:
+                report.reject(line, e)
+
+    for chunk in bulk_io.chunked(valid_records(), app.config['IMPORT_CHUNK_SIZE']):
+        try:
+            importer(chunk, report)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            raise
+        if progress:
+            progress(report, time.perf_counter() - start)
+    report.seconds = time.perf_counter() - start
+    return report
+
+def bulk_export(kind, file_format):
+    """
+    Yields every student, enrollment or grade as CSV/JSONL text chunks,
+    reading the rows from the database in batches.
+    """
+    if kind == 'students':
+        query = (db.select(User.username, Student.name, Student.address, Student.group)
+                 .join(Student.user).order_by(Student.id))
+    else:
+        columns = [User.username, Course.name, Course.teacher]
+        model = Enrollment if kind == 'enrollments' else Grade
+        if model is Grade:
+            columns.append(Grade.value)
+        query = (db.select(*columns).select_from(model).join(Student).join(User).join(Course)
+                 .order_by(model.id))
+    rows = db.session.execute(query.execution_options(yield_per=1000))
+    yield from bulk_io.write_records(rows, file_format, bulk_io.EXPORT_FIELDS[kind])
+
+@app.cli.command('bulk-import')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('file', type=click.Path(exists=True, dir_okay=False))
+def bulk_import_command(kind, file):
+    """Import students, enrollments or grades from a .csv or .jsonl FILE."""
+    def progress(report, seconds):
+        print(f"\r{report.read} records ({report.read / seconds:.0f}/s)", end='', file=sys.stderr, flush=True)
+
+    # utf-8-sig drops the byte order mark spreadsheet programs write
+    with open(file, 'r', encoding='utf-8-sig', newline='') as records:
+        report = bulk_import(kind, records, bulk_io.detect_format(file), progress)
+    print(file=sys.stderr)
+    for error in report.errors:
+        print(error, file=sys.stderr)
+    print(report.summary())
+
+@app.cli.command('bulk-export')
+@click.argument('kind', type=click.Choice(list(IMPORTERS)))
+@click.argument('output', type=click.Path(dir_okay=False, writable=True))
+def bulk_export_command(kind, output):
+    """Write every student, enrollment or grade to a .csv or .jsonl OUTPUT file."""
+    with open(output, 'w', encoding='utf-8', newline='') as file:
+        for chunk in bulk_export(kind, bulk_io.detect_format(output)):
+            file.write(chunk)
+    print(f"Wrote {output}")
+
+@app.route('/admin/import', methods=['POST'])
+@login_required
+def admin_import():
+    if current_user.role != 'admin':
+        flash("You must be an admin!")
+        return redirect(url_for('home'))
+
+    kind = request.form.get('kind')
+    upload = request.files.get('file')
+    if kind not in IMPORTERS or not upload or not upload.filename:
+        flash("Choose what to import and a file!")
+        return redirect(url_for('admin_dashboard'))
+    try:
+        file_format = bulk_io.detect_format(upload.filename)
+    except ValueError as e:
+        flash(str(e))
+        return redirect(url_for('admin_dashboard'))
+
+    # Read straight from the upload stream, Werkzeug spools large files to disk
+    records = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    report = bulk_import(kind, records, file_format)
+    flash(report.summary())
+    for error in report.errors:
+        flash(error)
+    return redirect(url_for('admin_dashboard'))
+
+@app.route('/admin/export', methods=['GET'])
+@login_required
+def admin_export():
+    if current_user.role != 'admin':
+        flash("You must be an admin!")
+        return redirect(url_for('home'))
+
+    kind = request.args.get('kind')
+    file_format = request.args.get('format', 'csv')
+    if kind not in IMPORTERS or file_format not in bulk_io.FORMATS:
+        flash("Unknown export!")
+        return redirect(url_for('admin_dashboard'))
+
+    mimetype = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(bulk_export(kind, file_format)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{file_format}'
     return response
 
 
+@app.cli.command('promote-faq')
+def promote_faq_command():
+    """Cluster the rejected FAQ questions and promote the frequent ones."""
+    start = time.perf_counter()
+    promoted = sbert_similarity.process_rejections()
+    for entry in promoted:
+        print(f"Promoted: {entry['question']}")
+    print(f"Promoted {len(promoted)} questions in {time.perf_counter() - start:.1f}s.")
+
+
+def add_missing_columns(model):
+    # db.create_all() only creates missing tables; add columns that were
+    # introduced after an existing table was created
+    table = model.__table__
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    with db.engine.begin() as connection:
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(db.engine.dialect)
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+            not_null = " NOT NULL" if not column.nullable and default else ""
+            connection.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}{not_null}{default}'))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+@app.cli.command('migrate-courses')
+def migrate_courses():
+    """Move the legacy JSON courses/grades columns into Enrollment and Grade rows."""
+    db.create_all()
+    add_missing_columns(Student)
+    students = Student.query.filter(Student.courses_json.isnot(None) | Student.grades_json.isnot(None)).all()
+    for student in students:
+        for entry in json.loads(student.courses_json or "[]"):
+            course_name, teacher_name = entry.rsplit(' - ', 1)
+            student.enroll_in_course(course_name, teacher_name)
+        for entry in json.loads(student.grades_json or "[]"):
+            course_name, teacher_name, grade = entry.rsplit(' - ', 2)
+            student.grade_student(course_name, teacher_name, int(grade.split(': ')[1]))
+        student.courses_json = None
+        student.grades_json = None
+    db.session.commit()
+    print(f"Migrated courses and grades of {len(students)} students.")
+
+@app.cli.command('migrate-questions')
+def migrate_questions():
+    """Move the legacy JSON question lists of employees into Question rows."""
+    db.create_all()
+    add_missing_columns(Employee)
+    add_missing_columns(Question)
+    employees = Employee.query.filter(Employee.questions_json.isnot(None)).all()
+    migrated = skipped = 0
+    for employee in employees:
+        for entry in json.loads(employee.questions_json or "[]"):
+            question_text, _, user_id = entry.rpartition(' - ')
+            student = Student.query.filter_by(user_id=int(user_id)).first() if user_id.isdigit() else None
+            if not question_text or student is None:
+                # Entries without a known student can't be answered anyway
+                skipped += 1
+                continue
+            db.session.add(Question(text=question_text, student_id=student.id, employee_id=employee.id))
+            migrated += 1
+        employee.questions_json = None
+        employee.open_questions = Question.query.filter_by(employee_id=employee.id, status='open').count()
+    db.session.commit()
+    print(f"Migrated {migrated} questions, skipped {skipped} without a known student.")
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()  # This will create the tables
         print("Database and tables created!")
+        fail_interrupted_subject_changes()
     app.run(debug=True)
\ No newline at end of file
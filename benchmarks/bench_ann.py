@@ -0,0 +1,76 @@
+"""
+Compares the brute-force and IVF similarity backends on synthetic corpora.
+
+The corpora are clustered random unit vectors shaped like SBERT embeddings,
+so no model is needed. Queries are noisy copies of stored rows and recall is
+measured against the exact (brute-force) top-1.
+
+Run from the repository root:
+    python -m benchmarks.bench_ann --sizes 1000 10000 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from similarity_backends import BruteForceBackend, IVFBackend
+
+DIMENSION = 384
+
+
+def normalize(matrix):
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_corpus(size, rng, topics=200):
+    centers = rng.standard_normal((topics, DIMENSION))
+    rows = centers[rng.integers(topics, size=size)] + 0.6 * rng.standard_normal((size, DIMENSION))
+    return normalize(rows)
+
+
+def make_queries(corpus, count, rng):
+    picked = corpus[rng.integers(len(corpus), size=count)]
+    return normalize(picked + 0.03 * rng.standard_normal(picked.shape))
+
+
+def time_search(backend, queries, batch_size):
+    found = []
+    start = time.perf_counter()
+    for begin in range(0, len(queries), batch_size):
+        found.append(backend.search(queries[begin:begin + batch_size], 1)[1][:, 0])
+    elapsed = time.perf_counter() - start
+    return np.concatenate(found), elapsed / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--batch-size', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>8} {'backend':>12} {'build s':>8} {'ms/query':>9} {'recall@1':>9}")
+    for size in args.sizes:
+        corpus = make_corpus(size, rng)
+        queries = make_queries(corpus, args.queries, rng)
+
+        brute = BruteForceBackend()
+        brute.build(corpus)
+        exact, brute_ms = time_search(brute, queries, args.batch_size)
+        print(f"{size:>8} {'brute':>12} {0:>8.2f} {brute_ms:>9.3f} {1:>9.3f}")
+
+        ivf = IVFBackend(min_rows=0)
+        start = time.perf_counter()
+        ivf.build(corpus)
+        build_time = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            ivf.n_probe = n_probe
+            found, ivf_ms = time_search(ivf, queries, args.batch_size)
+            recall = float(np.mean(found == exact))
+            print(f"{size:>8} {f'ivf/{n_probe}':>12} {build_time:>8.2f} {ivf_ms:>9.3f} {recall:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Concurrent read/write throughput of the SQLite database, with SQLite's
+defaults (rollback journal, synchronous=FULL) and with the pragmas from
+config.SQLITE_PRAGMAS.
+
+Reader processes run the student inbox query, writer processes assign
+questions the way Employee.assign_question does (UPDATE ... RETURNING on
+the least loaded employee plus an INSERT, in one transaction). Each mode
+runs on its own throwaway database.
+
+To measure a PostgreSQL server instead, pass its URL (the tables are
+created in it and the data left behind):
+    python -m benchmarks.bench_db_concurrency --url postgresql://...
+
+Run from the repository root:
+    python -m benchmarks.bench_db_concurrency [--readers 4] [--writers 4] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, event, text
+
+import config
+
+STUDENTS = 1000
+EMPLOYEES = 20
+QUESTIONS = 20000
+
+MODES = {
+    'default': {'busy_timeout': 5000},
+    'config': config.SQLITE_PRAGMAS,
+}
+
+SCHEMA = [
+    "CREATE TABLE employee (id INTEGER PRIMARY KEY, open_questions INTEGER NOT NULL DEFAULT 0, "
+    "last_assigned_at TIMESTAMP)",
+    "CREATE TABLE question (id INTEGER PRIMARY KEY, text TEXT NOT NULL, student_id INTEGER NOT NULL, "
+    "employee_id INTEGER, status VARCHAR(20) NOT NULL, created_at TIMESTAMP NOT NULL, "
+    "answer TEXT, answered_at TIMESTAMP)",
+    "CREATE INDEX ix_question_student_inbox ON question (student_id, answered_at, id)",
+    "CREATE INDEX ix_employee_open_questions ON employee (open_questions)",
+]
+
+READ = text("SELECT id, text, answer, answered_at FROM question "
+            "WHERE student_id = :student AND answered_at IS NOT NULL "
+            "ORDER BY answered_at DESC, id DESC LIMIT 21")
+ASSIGN = text("UPDATE employee SET open_questions = open_questions + 1, last_assigned_at = CURRENT_TIMESTAMP "
+              "WHERE id = (SELECT id FROM employee ORDER BY open_questions, id LIMIT 1) RETURNING id")
+INSERT = text("INSERT INTO question (text, student_id, employee_id, status, created_at) "
+              "VALUES (:text, :student, :employee, 'open', CURRENT_TIMESTAMP)")
+
+
+def make_engine(url, pragmas):
+    engine = create_engine(url)
+    if pragmas is not None and engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            config.apply_sqlite_pragmas(dbapi_connection, pragmas)
+    return engine
+
+
+def seed(engine):
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+        connection.execute(text("INSERT INTO employee (open_questions) VALUES (0)"),
+                           [{}] * EMPLOYEES)
+        connection.execute(
+            text("INSERT INTO question (text, student_id, employee_id, status, created_at, answer, answered_at) "
+                 "VALUES ('Question', :student, 1, 'answered', CURRENT_TIMESTAMP, 'Answer', CURRENT_TIMESTAMP)"),
+            [{'student': i % STUDENTS} for i in range(QUESTIONS)])
+
+
+def worker(url, pragmas, role, seconds, results):
+    engine = make_engine(url, pragmas)
+    operations = errors = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        student = random.randrange(STUDENTS)
+        try:
+            if role == 'read':
+                with engine.connect() as connection:
+                    connection.execute(READ, {'student': student}).fetchall()
+            else:
+                with engine.begin() as connection:
+                    employee = connection.execute(ASSIGN).scalar()
+                    connection.execute(INSERT, {'text': 'New question', 'student': student, 'employee': employee})
+            operations += 1
+        except Exception:
+            # "database is locked" once the busy timeout runs out
+            errors += 1
+    results.put((role, operations, errors))
+
+
+def run(url, pragmas, readers, writers, seconds):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(url, pragmas, role, seconds, results))
+                 for role in ['read'] * readers + ['write'] * writers]
+    for process in processes:
+        process.start()
+    totals = {'read': [0, 0], 'write': [0, 0]}
+    for _ in processes:
+        role, operations, errors = results.get()
+        totals[role][0] += operations
+        totals[role][1] += errors
+    for process in processes:
+        process.join()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent read/write throughput of the database.")
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--url', help="Database to measure instead of throwaway SQLite files")
+    args = parser.parse_args()
+
+    if args.url:
+        modes = {'pooled': None}
+    else:
+        modes = MODES
+
+    print(f"{args.readers} readers, {args.writers} writers, {args.seconds:g}s each")
+    print(f"{'mode':>8} {'reads/s':>10} {'writes/s':>10} {'errors':>7}")
+    for name, pragmas in modes.items():
+        url = args.url or f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench-db-'), 'bench.db')}"
+        engine = make_engine(url, pragmas)
+        seed(engine)
+        engine.dispose()
+        totals = run(url, pragmas, args.readers, args.writers, args.seconds)
+        reads, read_errors = totals['read']
+        writes, write_errors = totals['write']
+        print(f"{name:>8} {reads / args.seconds:>10.0f} {writes / args.seconds:>10.0f} "
+              f"{read_errors + write_errors:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Checks and compares the SBERT inference modes and FAQ embedding storage
+types against the fp32 baseline (SBERT_INFERENCE=torch,
+FAQ_EMBEDDING_DTYPE=float32).
+
+Every mode runs in a fresh interpreter that indexes faq.json and matches
+its questions plus a few rewordings of each. The script reports, per
+mode, whether every top-1 match equals the baseline's, the model load
+time, single-question latency, batch throughput and peak RSS, and exits
+non-zero if any top-1 match differs.
+
+Run from the repository root:
+    python -m benchmarks.bench_inference [--modes torch:float16 int8:int8 onnx:float32 ...]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+BASELINE = 'torch:float32'
+DEFAULT_MODES = ['torch:float16', 'torch:int8', 'int8:float32', 'int8:int8', 'onnx:float32', 'onnx:int8']
+
+PROBE = """
+import json, os, resource, sys, tempfile, time
+start = time.perf_counter()
+import sbert_similarity as S
+model = S.get_model()
+load = time.perf_counter() - start
+
+with open('faq.json') as file:
+    faq = [entry['question'] for entry in json.load(file)['faq']]
+queries = []
+for question in faq:
+    bare = question.rstrip('?.!')
+    queries += [question, bare.lower(), 'Hi, ' + bare[0].lower() + bare[1:] + '?', question + ' Thanks!']
+
+index = S.FaqIndex(os.path.join(tempfile.mkdtemp(), 'faq'), faq)
+top1 = [matches[0][0] if matches else None for matches in index.rank(S._encode_batch(queries), 1, -1.0)]
+
+start = time.perf_counter()
+for query in queries:
+    index.rank(S._encode_batch([query]), 1)
+single = (time.perf_counter() - start) / len(queries)
+
+start = time.perf_counter()
+for _ in range(3):
+    S._encode_batch(queries)
+batch = 3 * len(queries) / (time.perf_counter() - start)
+
+print(json.dumps({
+    'top1': top1, 'load': load, 'single_ms': single * 1000, 'batch_per_s': batch,
+    'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'matrix_bytes': int(index.embeddings.nbytes),
+}))
+"""
+
+
+def run_mode(mode):
+    inference, dtype = mode.split(':')
+    env = dict(os.environ, SBERT_INFERENCE=inference, FAQ_EMBEDDING_DTYPE=dtype)
+    process = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        # Typically the optional ONNX dependencies are not installed
+        return {'error': process.stderr.strip().splitlines()[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SBERT inference modes with the fp32 baseline.")
+    parser.add_argument('--modes', nargs='+', default=DEFAULT_MODES,
+                        help="INFERENCE:DTYPE pairs, e.g. int8:float16")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    baseline = run_mode(BASELINE)
+    if 'error' in baseline:
+        sys.exit(f"Baseline failed: {baseline['error']}")
+
+    print(f"{'mode':<14} {'top-1':>12} {'load s':>7} {'ms/query':>9} {'batch/s':>8} {'RSS MB':>7} {'matrix KB':>10}")
+    differing = []
+    for mode in [BASELINE] + [mode for mode in args.modes if mode != BASELINE]:
+        result = baseline if mode == BASELINE else run_mode(mode)
+        if 'error' in result:
+            print(f"{mode:<14} unavailable: {result['error']}")
+            continue
+        same = sum(a == b for a, b in zip(result['top1'], baseline['top1']))
+        if same != len(baseline['top1']):
+            differing.append(mode)
+        agreement = f"{same}/{len(baseline['top1'])}"
+        print(f"{mode:<14} {agreement:>12} {result['load']:>7.2f} "
+              f"{result['single_ms']:>9.2f} {result['batch_per_s']:>8.0f} {result['rss_mb']:>7.0f} "
+              f"{result['matrix_bytes'] / 1024:>10.1f}")
+
+    print(f"({time.perf_counter() - start:.0f}s)")
+    if differing:
+        print(f"Top-1 matches differ from {BASELINE} with: {', '.join(differing)}")
+        sys.exit(1)
+    print(f"Every top-1 match is the same as with {BASELINE}.")
+
+
+if __name__ == "__main__":
+    main()
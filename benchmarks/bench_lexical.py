@@ -0,0 +1,134 @@
+"""
+How many FAQ lookups the lexical first stage answers without the model,
+and whether it picks the same entry the model would.
+
+The question log is synthetic by default: faq.json questions copied as
+they are, retyped without case or punctuation, with a typo, wrapped in
+greetings, reworded, and questions the FAQ doesn't cover. Pass --log with
+a JSONL file (one question or {"question": ...} per line) to use a real
+one instead.
+
+Run from the repository root:
+    python -m benchmarks.bench_lexical [--queries 2000] [--log questions.jsonl]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+import sbert_similarity as S
+
+REWORDED = [
+    "How can I make an account?",
+    "I can't remember my password, what do I do?",
+    "Where do I see my marks?",
+    "How to sign up for classes?",
+    "How can I withdraw from a class?",
+    "Where is my timetable?",
+    "How can I pay the tuition?",
+    "Is it possible to get a copy of my transcript?",
+    "How do I reach my teacher?",
+    "Where do I upload my homework?",
+    "What do I do when the site doesn't work?",
+    "Is there a cafeteria on campus?",
+]
+NEW = [
+    "Can I bring my dog to the dorm?",
+    "Who won the football match yesterday?",
+    "Is the gym open on Sundays?",
+    "How much does parking cost per month?",
+    "Can I change my group to 312CA?",
+    "When is the next student council election?",
+    "Are there lockers near the library?",
+    "Can my parents attend the graduation ceremony?",
+]
+# Share of the log of each kind of question
+KINDS = {'copy': 0.2, 'retyped': 0.2, 'typo': 0.15, 'greeting': 0.15, 'reworded': 0.15, 'new': 0.15}
+
+
+def typo(question, rng):
+    words = question.split()
+    long_words = [i for i, word in enumerate(words) if len(word) >= 4]
+    if not long_words:
+        return question
+    i = rng.choice(long_words)
+    j = rng.randrange(len(words[i]) - 1)
+    word = words[i]
+    words[i] = word[:j] + word[j + 1] + word[j] + word[j + 2:]
+    return ' '.join(words)
+
+
+def make_log(faq, count, seed=0):
+    rng = random.Random(seed)
+    kinds, weights = zip(*KINDS.items())
+    log = []
+    for kind in rng.choices(kinds, weights, k=count):
+        question = rng.choice(faq)
+        if kind == 'retyped':
+            question = question.lower().rstrip('?.!')
+        elif kind == 'typo':
+            question = typo(question, rng)
+        elif kind == 'greeting':
+            question = f"Hi, {question[0].lower()}{question[1:]} Thanks!"
+        elif kind == 'reworded':
+            question = rng.choice(REWORDED)
+        elif kind == 'new':
+            question = rng.choice(NEW)
+        log.append((kind, question))
+    return log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lexical first stage of FAQ lookups.")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--log', help="JSONL question log to use instead of the synthetic one")
+    args = parser.parse_args()
+
+    with open('faq.json') as file:
+        faq = [entry['question'] for entry in json.load(file)['faq']]
+    if args.log:
+        with open(args.log) as file:
+            log = [('log', question) for question in S.read_questions(file)]
+    else:
+        log = make_log(faq, args.queries)
+    questions = [question for _, question in log]
+
+    index = S.FaqIndex(os.path.join(tempfile.mkdtemp(), 'faq'), faq)
+
+    start = time.perf_counter()
+    lexical = [index.lexical_match(question) for question in questions]
+    lexical_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embeddings = [S.encode(question, convert_to_numpy=True, normalize_embeddings=True) for question in questions]
+    model_time = time.perf_counter() - start
+    model = [matches[0] if matches else (None, 0.0) for matches in index.rank(np.asarray(embeddings), 1, -1.0)]
+
+    by_kind = defaultdict(lambda: [0, 0, 0])
+    for (kind, _), skipped, (model_idx, model_score) in zip(log, lexical, model):
+        counts = by_kind[kind]
+        counts[0] += 1
+        if skipped is not None:
+            counts[1] += 1
+            # The model would have answered with the same entry
+            counts[2] += skipped[0] == model_idx and model_score >= S.SIMILARITY_THRESHOLD
+
+    print(f"{'kind':<10} {'queries':>8} {'skipped':>8} {'same as model':>14}")
+    for kind, (total, skipped, same) in by_kind.items():
+        print(f"{kind:<10} {total:>8} {skipped / total:>8.0%} {f'{same}/{skipped}':>14}")
+
+    skipped = sum(match is not None for match in lexical)
+    same = sum(counts[2] for counts in by_kind.values())
+    print(f"\nSkipped the model for {skipped}/{len(log)} queries ({skipped / len(log):.0%}), "
+          f"{same} of them with the entry the model picks.")
+    print(f"Lexical stage: {lexical_time / len(log) * 1e6:.0f} us/query, "
+          f"model: {model_time / len(log) * 1000:.2f} ms/query")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Login throughput at different bcrypt costs.
+
+For each cost a user is stored with a hash at that cost and POST /login
+is sent for a few seconds from one client thread (throughput per core),
+then from one thread per core through the password pool. The database
+is a throwaway SQLite file.
+
+Run from the repository root:
+    python -m benchmarks.bench_login [--costs 4 8 10 12] [--seconds 3]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='bench-login-'), 'bench.db')
+os.environ['DATABASE_URL'] = f"sqlite:///{DATABASE}"
+
+import app as A  # noqa: E402
+
+PASSWORD = 'password1'
+
+
+def logins_per_second(username, threads, seconds):
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def run(index):
+        client = A.app.test_client()
+        while time.perf_counter() < deadline:
+            response = client.post('/login', data={'username': username, 'password': PASSWORD})
+            assert response.status_code == 302, response.status_code
+            counts[index] += 1
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput per bcrypt cost.")
+    parser.add_argument('--costs', type=int, nargs='+', default=[4, 8, 10, 12])
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    A.app.config['WTF_CSRF_ENABLED'] = False
+    cores = os.cpu_count() or 1
+    with A.app.app_context():
+        A.db.create_all()
+
+    print(f"{'cost':>4} {'1 thread/s':>11} {f'{cores} threads/s':>13} {'ms/login':>9}")
+    for cost in args.costs:
+        # Store the hash at this cost, and log in at it so nothing is rehashed
+        A.app.config['BCRYPT_LOG_ROUNDS'] = cost
+        username = f'login{cost:02d}'
+        with A.app.app_context():
+            A.db.session.add(A.User(username=username, password=A.bulk_io.hash_password(PASSWORD, cost),
+                                    role='admin'))
+            A.db.session.commit()
+
+        single = logins_per_second(username, 1, args.seconds)
+        parallel = logins_per_second(username, cores, args.seconds)
+        print(f"{cost:>4} {single:>11.1f} {parallel:>13.1f} {1000 / single:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
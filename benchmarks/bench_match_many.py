@@ -0,0 +1,63 @@
+"""
+Compares answering questions one by one with the batched match_many API.
+
+Both paths encode every question: the query cache and the lexical stage,
+which would answer the repeated FAQ questions without the model, are
+turned off. The FAQ is imported from faq.json into a throwaway store, the
+app's database and sidecars are never touched.
+
+Run from the repository root:
+    python -m benchmarks.bench_match_many --questions 2000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench-match-many-')
+os.environ['FAQ_DATABASE'] = os.path.join(WORKDIR, 'faq.db')
+
+import sbert_similarity  # noqa: E402
+
+
+def make_questions(faq_questions, count, seed=0):
+    rng = random.Random(seed)
+    prefixes = ["", "Hi, ", "Quick question: ", "Please help, "]
+    suffixes = ["", " Thanks!", " ?", " (urgent)"]
+    return [rng.choice(prefixes) + rng.choice(faq_questions) + rng.choice(suffixes) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--questions', type=int, default=1000)
+    parser.add_argument('--batch-size', type=int, default=sbert_similarity.BATCH_SIZE)
+    args = parser.parse_args()
+
+    faqs, question_list, answer_list = sbert_similarity.get_faqs('faq.json')
+    faq_index = sbert_similarity.get_index('faq.json')
+    questions = make_questions(question_list, args.questions)
+
+    # Measure N encodes against one batched encode, nothing answered early
+    sbert_similarity.LEXICAL_THRESHOLD = 2.0
+    faq_index.cache.max_size = 0
+    faq_index.cache.clear()
+
+    start = time.perf_counter()
+    single = [faq_index.search(question)[0] for question in questions]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched = [matches[0][0] if matches else None
+               for _, matches in sbert_similarity.match_many(questions, top_k=1, batch_size=args.batch_size)]
+    batch_time = time.perf_counter() - start
+
+    print(f"questions:  {len(questions)}")
+    print(f"single:     {single_time:.2f}s ({len(questions) / single_time:.0f} q/s)")
+    print(f"batched:    {batch_time:.2f}s ({len(questions) / batch_time:.0f} q/s, batch size {args.batch_size})")
+    print(f"speedup:    {single_time / batch_time:.1f}x")
+    print(f"same top-1: {sum(a == b for a, b in zip(single, batched))}/{len(questions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures subject-change request generation.
+
+  - cold:   one PDF per request with the signature cache cleared every
+            time, i.e. what every request used to cost
+  - single: one PDF per request with the signature cache warm
+  - batch:  all requests as pages of one PDF via fill_forms()
+
+Run from the repository root:
+    python -m benchmarks.bench_request_forms --requests 500
+"""
+import argparse
+import io
+import time
+
+import change_sub_pdf_gen as forms
+
+
+def make_requests(count):
+    subjects = frozenset(f"Subject{i}" for i in range(40))
+    return [
+        (forms.SUBJECT_CHANGE, {
+            "student_first_name": f"Student{i}",
+            "student_last_name": "Popescu",
+            "student_addr": "Strada Castanilor 1",
+            "student_group": "324CC",
+            "subject_list": subjects,
+            "old_subject": f"Subject{i % 40}",
+            "new_subject": "Inteligenta Artificiala",
+            "new_teacher": "Ionescu",
+        }, i % 3 + 1)
+        for i in range(count)
+    ]
+
+
+def run(name, requests, action):
+    start = time.perf_counter()
+    size = action(requests)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>7}: {len(requests) / elapsed:8.1f} requests/s  ({size / 1024:.0f} KB written)")
+
+
+def one_by_one(requests, cold=False):
+    size = 0
+    for template, values, signature_id in requests:
+        if cold:
+            forms.decode_signature.cache_clear()
+        output = io.BytesIO()
+        forms.fill_form(output, template, values, signature_id)
+        size += len(output.getvalue())
+    return size
+
+
+def batch(requests):
+    output = io.BytesIO()
+    forms.fill_forms(output, requests)
+    return len(output.getvalue())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=300)
+    args = parser.parse_args()
+
+    requests = make_requests(args.requests)
+    run('cold', requests, lambda r: one_by_one(r, cold=True))
+    run('single', requests, one_by_one)
+    run('batch', requests, batch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Measures what importing sbert_similarity costs a process.
+
+Every step runs in a fresh interpreter and reports wall time and peak RSS:
+  - import:     importing the module (all a Flask worker pays at start now)
+  - first use:  import + loading the model and encoding one question
+                (what every import used to cost before the model was lazy)
+
+Run from the repository root:
+    python -m benchmarks.bench_startup
+"""
+import subprocess
+import sys
+
+STEPS = {
+    'import': "import sbert_similarity",
+    'first use': "import sbert_similarity; sbert_similarity.get_model().encode('hello')",
+}
+
+PROBE = """
+import resource, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def measure(code, runs=3):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(code=code)],
+                                capture_output=True, text=True, check=True).stdout
+        elapsed, rss_kb = output.split()[-2:]
+        samples.append((float(elapsed), int(rss_kb) / 1024))
+    return min(samples)
+
+
+def main():
+    print(f"{'step':>10} {'seconds':>8} {'peak RSS MB':>12}")
+    for name, code in STEPS.items():
+        elapsed, rss_mb = measure(code)
+        print(f"{name:>10} {elapsed:>8.2f} {rss_mb:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+Benchmark suite for the app's hot paths, with results written as JSON so
+runs can be compared over time.
+
+Seeds a throwaway SQLite database with synthetic students, employees,
+courses, grades and questions, and a synthetic FAQ corpus, then measures:
+- faq: model load and index build time, FAQ lookup latency (new and
+  cached questions) and throughput with concurrent clients
+- login: POST /login throughput and latency with concurrent clients
+- assignment: POST /ask_question from concurrent students, checking that
+  no employee ends up over MAX_OPEN_QUESTIONS
+- pdf: grade reports rendered per second, and cached reports served
+- dashboard: render time of the student, employee and admin pages
+
+The app's own database and FAQ store are never touched. Run from the
+repository root:
+    python -m benchmarks.suite [--students 1000] [--faq 500] [--only faq login ...]
+                               [--output results.json] [--compare earlier.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+WORKDIR = tempfile.mkdtemp(prefix='bench-suite-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'bench.db')}"
+os.environ['FAQ_DATABASE'] = os.path.join(WORKDIR, 'faq.db')
+os.environ['FLASK_PDF_CACHE_DIR'] = os.path.join(WORKDIR, 'pdf_cache')
+os.environ['FLASK_DOCUMENTS_DIR'] = os.path.join(WORKDIR, 'documents')
+# Promotion rounds would compete with the measured requests
+os.environ['FLASK_FAQ_JOBS_INTERVAL'] = '0'
+
+import app as A  # noqa: E402
+import sbert_similarity as S  # noqa: E402
+from faq_store import FaqStore  # noqa: E402
+
+PASSWORD = 'password1'
+SCENARIOS = ('faq', 'login', 'assignment', 'pdf', 'dashboard')
+
+SUBJECTS = ['exam', 'grade', 'scholarship', 'enrollment', 'transcript', 'timetable', 'dorm room',
+            'library card', 'student ID', 'internship', 'thesis', 'tuition fee', 'course', 'password']
+ACTIONS = ['get', 'change', 'cancel', 'renew', 'appeal', 'check', 'pay for', 'apply for', 'find', 'replace']
+TIMES = ['', ' this semester', ' after the deadline', ' online', ' for next year', ' as an exchange student']
+FILLERS = ['Hi, ', 'Quick question: ', 'Please help, ', '']
+
+
+def percentiles(seconds):
+    """
+    Summarizes latencies in milliseconds.
+    """
+    if not seconds:
+        return {}
+    ordered = sorted(seconds)
+
+    def at(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {'count': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50_ms': at(0.50), 'p95_ms': at(0.95), 'p99_ms': at(0.99)}
+
+
+def run_clients(count, work):
+    """
+    Runs work(index) on `count` threads at once.
+
+    Returns:
+        tuple: (latencies of every call work() timed, wall seconds).
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def run(index):
+        mine = work(index)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def faq_questions(count):
+    """
+    `count` distinct synthetic FAQ questions.
+    """
+    questions = []
+    for subject in SUBJECTS:
+        for action in ACTIONS:
+            for when in TIMES:
+                questions.append(f"How do I {action} my {subject}{when}?")
+    if count > len(questions):
+        questions += [f"{question} (campus {i})" for i in range(count // len(questions) + 1) for question in questions]
+    return questions[:count]
+
+
+def login(username):
+    client = A.app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302, (username, response.status_code)
+    return client
+
+
+def seed(args):
+    """
+    Fills the database in bulk, the same way `flask bulk-import` does, and
+    the FAQ store with `args.faq` synthetic entries.
+    """
+    rng = random.Random(args.seed)
+    db = A.db
+    # One hash for everyone at the configured cost, bcrypt would dominate
+    # seeding otherwise
+    password_hash = A.hash_password(PASSWORD)
+
+    with A.app.app_context():
+        db.drop_all()
+        db.create_all()
+        users = [{'username': 'admin', 'password': password_hash, 'role': 'admin'}]
+        users += [{'username': f'employee{i}', 'password': password_hash, 'role': 'employee'}
+                  for i in range(args.employees)]
+        users += [{'username': f'student{i}', 'password': password_hash, 'role': 'student'}
+                  for i in range(args.students)]
+        user_ids = db.session.execute(db.insert(A.User).returning(A.User.id, sort_by_parameter_order=True),
+                                      users).scalars().all()
+        employee_ids = db.session.execute(
+            db.insert(A.Employee).returning(A.Employee.id, sort_by_parameter_order=True),
+            [{'user_id': user_id} for user_id in user_ids[1:1 + args.employees]]).scalars().all()
+        student_ids = db.session.execute(
+            db.insert(A.Student).returning(A.Student.id, sort_by_parameter_order=True),
+            [{'user_id': user_id, 'name': f'Student {i}', 'address': f'Street {i}', 'group': f'3{i % 4}{i % 3}CA'}
+             for i, user_id in enumerate(user_ids[1 + args.employees:])]).scalars().all()
+        course_ids = db.session.execute(
+            db.insert(A.Course).returning(A.Course.id, sort_by_parameter_order=True),
+            [{'name': f'Course {i}', 'teacher': f'Teacher {i}'} for i in range(args.courses)]).scalars().all()
+
+        enrollments, grades, questions = [], [], []
+        now = datetime.utcnow()
+        for student_id in student_ids:
+            for course_id in rng.sample(course_ids, min(args.grades, len(course_ids))):
+                enrollments.append({'student_id': student_id, 'course_id': course_id})
+                grades.append({'student_id': student_id, 'course_id': course_id, 'value': rng.randint(4, 10)})
+            for j in range(args.answered):
+                questions.append({'text': f'Seeded question {j}', 'student_id': student_id,
+                                  'employee_id': rng.choice(employee_ids), 'status': 'answered',
+                                  'answer': 'Seeded answer', 'created_at': now, 'answered_at': now})
+        db.session.execute(db.insert(A.Enrollment), enrollments)
+        db.session.execute(db.insert(A.Grade), grades)
+        if questions:
+            db.session.execute(db.insert(A.Question), questions)
+        db.session.commit()
+
+    store = FaqStore()
+    for i, question in enumerate(faq_questions(args.faq)):
+        store.add_faq(question, f'Answer {i}')
+
+
+def bench_faq(args):
+    rng = random.Random(args.seed)
+    corpus = faq_questions(args.faq)
+    _, load = timed(S.get_model)
+    _, build = timed(S.get_index, 'faq')
+
+    # Rewordings of stored questions, and questions no entry answers; the
+    # number keeps them apart in the query cache
+    def question(i):
+        if i % 4 == 3:
+            return f"Is parking free near building {i} on weekends?"
+        return f"{rng.choice(FILLERS)}{rng.choice(corpus).rstrip('?').lower()} #{i}?"
+
+    questions = [question(i) for i in range(args.queries)]
+    answered = 0
+    new = []
+    for text in questions:
+        (answer, _), seconds = timed(S.faq_answer, text, 30)
+        answered += answer is not None
+        new.append(seconds)
+    cached = [timed(S.faq_answer, text, 30)[1] for text in questions]
+
+    # Concurrent clients share forward passes through the embedding service
+    concurrent_questions = [question(args.queries + i) for i in range(args.queries)]
+
+    def client(index):
+        return [timed(S.faq_answer, text, 30)[1] for text in concurrent_questions[index::args.clients]]
+
+    concurrent, wall = run_clients(args.clients, client)
+    return {
+        'corpus': len(corpus),
+        'model_load_s': round(load, 3),
+        'index_build_s': round(build, 3),
+        'answered_share': round(answered / len(questions), 3),
+        'new': percentiles(new),
+        'cached': percentiles(cached),
+        'concurrent': dict(percentiles(concurrent), clients=args.clients,
+                           per_s=round(len(concurrent) / wall, 1)),
+    }
+
+
+def bench_login(args):
+    def client(index):
+        latencies = []
+        deadline = time.perf_counter() + args.seconds
+        while time.perf_counter() < deadline:
+            latencies.append(timed(login, f'student{index}')[1])
+        return latencies
+
+    latencies, wall = run_clients(args.clients, client)
+    return dict(percentiles(latencies), clients=args.clients, bcrypt_rounds=A.app.config['BCRYPT_LOG_ROUNDS'],
+                per_s=round(len(latencies) / wall, 1))
+
+
+def bench_assignment(args):
+    # Students the login scenario didn't use, so none of them has questions yet
+    clients = [login(f'student{args.students - 1 - i}') for i in range(args.clients)]
+
+    def client(index):
+        latencies = []
+        for j in range(args.asks):
+            text = f"Can someone look at my case {index}-{j}, reference {random.random():.8f}?"
+            response, seconds = timed(clients[index].post, '/ask_question', data={'question': text})
+            assert response.status_code == 302, response.status_code
+            latencies.append(seconds)
+        return latencies
+
+    latencies, wall = run_clients(args.clients, client)
+    with A.app.app_context():
+        open_questions = A.db.session.scalar(
+            A.db.select(A.db.func.count(A.Question.id)).where(A.Question.status == 'open'))
+        counters = A.db.session.execute(A.db.select(A.Employee.open_questions)).scalars().all()
+    cap = A.app.config['MAX_OPEN_QUESTIONS']
+    return dict(percentiles(latencies), clients=args.clients, per_s=round(len(latencies) / wall, 1),
+                assigned=open_questions, not_assigned=len(latencies) - open_questions,
+                consistent=sum(counters) == open_questions and max(counters, default=0) <= cap)
+
+
+def bench_pdf(args):
+    with A.app.app_context():
+        students = (A.Student.query.options(A.db.selectinload(A.Student.grade_entries))
+                    .order_by(A.Student.id).limit(args.pdfs).all())
+        with A.app.test_request_context():
+            rendered = [timed(A.grades_pdf, student)[1] for student in students]
+            cached = [timed(A.grades_pdf, student)[1] for student in students]
+    return {
+        'rendered': dict(percentiles(rendered), per_s=round(len(rendered) / sum(rendered), 2)),
+        'cached': dict(percentiles(cached), per_s=round(len(cached) / sum(cached), 1)),
+    }
+
+
+def bench_dashboard(args):
+    pages = {
+        'student0': ['/dashboard', '/inbox', '/student/1'],
+        'employee0': ['/employee_dashborad'],
+        'admin': ['/admin_dashboard'],
+    }
+    results = {}
+    for username, urls in pages.items():
+        client = login(username)
+        for url in urls:
+            latencies = []
+            for _ in range(args.requests):
+                response, seconds = timed(client.get, url)
+                assert response.status_code == 200, (url, response.status_code)
+                latencies.append(seconds)
+            results[url] = percentiles(latencies)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def compare(earlier, current):
+    """
+    Prints every number of `current` next to the same one in `earlier`.
+    """
+    before = dict(flatten(earlier['results']))
+    print(f"\n{'metric':<44} {earlier.get('commit') or 'before':>12} {current.get('commit') or 'now':>12} {'change':>8}")
+    for key, value in flatten(current['results']):
+        if key not in before:
+            continue
+        change = f"{(value - before[key]) / before[key] * 100:+.0f}%" if before[key] else ''
+        print(f"{key:<44} {before[key]:>12} {value:>12} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths.")
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--employees', type=int, default=50)
+    parser.add_argument('--courses', type=int, default=40)
+    parser.add_argument('--grades', type=int, default=6, help="Courses (and grades) per student")
+    parser.add_argument('--answered', type=int, default=2, help="Answered questions per student")
+    parser.add_argument('--faq', type=int, default=500, help="Synthetic FAQ entries")
+    parser.add_argument('--queries', type=int, default=200, help="FAQ lookups per measurement")
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients")
+    parser.add_argument('--seconds', type=float, default=5, help="Duration of the login measurement")
+    parser.add_argument('--asks', type=int, default=10, help="Questions asked per client")
+    parser.add_argument('--pdfs', type=int, default=20, help="Grade reports rendered")
+    parser.add_argument('--requests', type=int, default=50, help="Requests per dashboard page")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--output', help="JSON results file (default bench-suite-<time>.json in the work "
+                                         "directory)")
+    parser.add_argument('--compare', help="Earlier results file to compare with")
+    args = parser.parse_args()
+    if args.clients > args.students // 2:
+        parser.error("--students must be at least twice --clients")
+
+    A.app.config['WTF_CSRF_ENABLED'] = False
+    started = datetime.now()
+    _, seeding = timed(seed, args)
+    print(f"Seeded {args.students} students and {args.faq} FAQ entries in {seeding:.1f}s ({WORKDIR})")
+
+    results = {}
+    for name in args.only:
+        try:
+            results[name], seconds = timed(globals()[f'bench_{name}'], args)
+        except Exception as e:
+            # One broken scenario (say WeasyPrint's system libraries are
+            # missing) shouldn't lose the others
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+            seconds = 0
+        print(f"{name}: {json.dumps(results[name])} ({seconds:.1f}s)")
+
+    report = {
+        'started_at': started.isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': dict(vars(args), sbert_inference=S.INFERENCE, embedding_dtype=S.EMBEDDING_DTYPE,
+                         index_backend=os.environ.get('FAQ_INDEX_BACKEND', 'brute'),
+                         bcrypt_rounds=A.app.config['BCRYPT_LOG_ROUNDS'],
+                         max_open_questions=A.app.config['MAX_OPEN_QUESTIONS']),
+        'seed_s': round(seeding, 2),
+        'results': results,
+    }
+    # Not in the repository unless asked for
+    output = args.output or os.path.join(WORKDIR, f"bench-suite-{started.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(json.load(file), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import csv
+import io
+import json
+from itertools import islice
+
+import bcrypt
+
+# Columns of every kind of record, in file order
+FIELDS = {
+    'students': ('username', 'password', 'name', 'address', 'group'),
+    'enrollments': ('username', 'course', 'teacher'),
+    'grades': ('username', 'course', 'teacher', 'grade'),
+}
+# Exports leave out the passwords, only their hashes are stored
+EXPORT_FIELDS = dict(FIELDS, students=('username', 'name', 'address', 'group'))
+# May be empty in an import
+OPTIONAL_FIELDS = {'address', 'group'}
+
+FORMATS = ('csv', 'jsonl')
+
+
+def detect_format(file_name):
+    """
+    Returns 'csv' or 'jsonl' from the extension of `file_name`.
+    """
+    extension = file_name.rsplit('.', 1)[-1].lower()
+    if extension in ('jsonl', 'ndjson', 'json'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise ValueError(f"Can't tell the format of '{file_name}', use .csv or .jsonl")
+
+
+def read_records(file, file_format):
+    """
+    Yields one dict per record of a text file, reading it line by line.
+    CSV files need a header row naming the columns. JSONL lines that
+    aren't valid JSON are yielded as None, so one bad line doesn't stop
+    the import.
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def write_records(records, file_format, fields):
+    """
+    Yields `records` (tuples in `fields` order) as chunks of CSV or JSONL
+    text, so an export can be streamed as it is read.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if file_format == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+    for count, record in enumerate(records, 1):
+        if writer:
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(dict(zip(fields, record))) + '\n')
+        if count % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def chunked(iterable, size):
+    """
+    Yields lists of up to `size` items.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def hash_password(password, rounds):
+    """
+    bcrypt hash of `password`, in the format flask_bcrypt checks. A plain
+    function so it can run in a process pool.
+    """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+class ImportReport:
+    """
+    Counts of an import in progress.
+    """
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.skipped = 0
+        self.seconds = 0
+        self.errors = []
+
+    def reject(self, line, reason):
+        self.skipped += 1
+        # Enough to fix the file, without keeping every bad row in memory
+        if len(self.errors) < 20:
+            self.errors.append(f"record {line}: {reason}")
+
+    def summary(self):
+        rate = self.read / self.seconds if self.seconds else 0
+        return (f"Imported {self.imported} of {self.read} records, skipped {self.skipped}, "
+                f"in {self.seconds:.1f}s ({rate:.0f} records/s).")
@@ -1,54 +1,226 @@
 from reportlab.lib.pagesizes import letter
+from reportlab.lib.utils import ImageReader
 from reportlab.pdfgen import canvas
 from datetime import datetime
+from functools import lru_cache
+from PIL import Image
+import os
 
+SIGNATURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "semnaturi")
+SIGNATURE_CACHE_SIZE = 256
+# Signatures are drawn in a 100pt box, ~300 dpi is plenty for print
+SIGNATURE_MAX_PIXELS = 400
 
-def generate_pdf(filename, student_first_name, student_last_name, student_addr, student_group, student_id,
-                 subject_list, old_subject, new_subject, new_teacher):
 
-    if old_subject in subject_list:
-        c = canvas.Canvas(filename, pagesize=letter)
-
-        c.setFont("Helvetica-Bold", 20)
-        c.drawCentredString(306, 750, "Cerere schimbare de materie")
-
-        c.setFont("Helvetica", 12)
-        c.drawString(
-            75, 680,
-            f"      Subsemnatul {student_first_name} {student_last_name}, student la Facultatea Automatica si Calculatoare,"
-        )
-
-        c.drawString(
-            75, 660,
-            f"grupa {student_group}, cu domiciliu {student_addr}, rog schimbarea materiei {old_subject}, cu materia"
-        )
-
-        c.drawString(
-            75, 640,
-            f"{new_subject}, coordonata de profesor {new_teacher}."
-        )
-
-        date = datetime.now().strftime("%d.%m.%Y")
-        c.drawString(
-            75, 150,
-            f"Data: {date}"
-        )
-
-        c.drawString(
-            400, 150, "Semnatura:"
-        )
-
-        try:
-            img = "semnaturi/semnatura" + str(student_id) + ".jpg"
-            c.drawImage(img, 400, 40, width=100, height=100)
-        except Exception as e:
-            c.drawString(
-                400, 40, "[Image not found: Replace with your image path]")
+class FormTemplate:
+    """
+    Declarative layout of a request form.
+
+    Args:
+        name (str): Template name, also used for the shared PDF form object.
+        static (list): (font, size, align, x, y, text) entries that are the
+            same on every copy. They are drawn once per document as a form
+            XObject and referenced from every page.
+        lines (list): (font, size, align, x, y, text) entries whose text is a
+            str.format() template filled from the request values, plus
+            {date}.
+        signature (tuple): (x, y, width, height) of the signature image.
+        missing_signature (str): Drawn instead when there is no signature.
+        check (callable): Optional check(values) -> error message or None,
+            run before anything is drawn.
+    """
+
+    def __init__(self, name, static, lines, signature=None, missing_signature=None, check=None):
+        self.name = name
+        self.static = static
+        self.lines = lines
+        self.signature = signature
+        self.missing_signature = missing_signature
+        self.check = check
+
+    def _draw_entries(self, c, entries, values=None):
+        for font, size, align, x, y, text in entries:
+            if values is not None:
+                text = text.format(**values)
+            c.setFont(font, size)
+            if align == 'centre':
+                c.drawCentredString(x, y, text)
+            else:
+                c.drawString(x, y, text)
+
+    def draw(self, c, values, signature_id=None):
+        """
+        Draws one filled copy of the form on the current page of `c`.
+        """
+        form_name = f"static_{self.name}"
+        if not c.hasForm(form_name):
+            c.beginForm(form_name)
+            self._draw_entries(c, self.static)
+            c.endForm()
+        c.doForm(form_name)
+
+        values = dict(values, date=values.get('date') or datetime.now().strftime("%d.%m.%Y"))
+        self._draw_entries(c, self.lines, values)
+
+        if self.signature:
+            x, y, width, height = self.signature
+            image = load_signature(signature_id) if signature_id is not None else None
+            if image is not None:
+                c.drawImage(image, x, y, width=width, height=height)
+            elif self.missing_signature:
+                c.setFont("Helvetica", 12)
+                c.drawString(x, y, self.missing_signature)
+
+
+def load_signature(student_id):
+    """
+    Returns a student's signature, decoded once and kept for later forms.
+
+    Only found signatures are cached, so one added after a form was made
+    without it shows up on the next form.
+
+    Returns:
+        ImageReader: The signature, or None if the student has none.
+    """
+    try:
+        return decode_signature(student_id)
+    except (OSError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=SIGNATURE_CACHE_SIZE)
+def decode_signature(student_id):
+    """
+    Reads a student's signature file. The image is flattened onto white and
+    shrunk to print resolution, and its pixel data is decoded up front, so
+    drawing it later never touches the file and the shared reader is safe
+    to use from several threads.
+
+    Raises:
+        OSError: If the student has no (readable) signature file.
+    """
+    with Image.open(f"{SIGNATURE_DIR}/semnatura{student_id}.jpg") as source:
+        source.thumbnail((SIGNATURE_MAX_PIXELS, SIGNATURE_MAX_PIXELS))
+        image = Image.new("RGB", source.size, "white")
+        rgba = source.convert("RGBA")
+        image.paste(rgba, mask=rgba)
+    reader = ImageReader(image)
+    reader.getRGBData()
+    return reader
+
+
+def check_subject_change(values):
+    # Callers that check many requests against the same subjects should
+    # pass a set, any other iterable is converted here
+    subjects = values['subject_list']
+    if not isinstance(subjects, (set, frozenset)):
+        subjects = set(subjects)
+    if values['old_subject'] not in subjects:
+        return "Studentul nu are aceasta materie in foaia matricola"
+    return None
+
 
+SUBJECT_CHANGE = FormTemplate(
+    name='schimbare_materie',
+    static=[
+        ("Helvetica-Bold", 20, 'centre', 306, 750, "Cerere schimbare de materie"),
+        ("Helvetica", 12, 'left', 400, 150, "Semnatura:"),
+    ],
+    lines=[
+        ("Helvetica", 12, 'left', 75, 680,
+         "      Subsemnatul {student_first_name} {student_last_name}, student la Facultatea Automatica si Calculatoare,"),
+        ("Helvetica", 12, 'left', 75, 660,
+         "grupa {student_group}, cu domiciliu {student_addr}, rog schimbarea materiei {old_subject}, cu materia"),
+        ("Helvetica", 12, 'left', 75, 640,
+         "{new_subject}, coordonata de profesor {new_teacher}."),
+        ("Helvetica", 12, 'left', 75, 150, "Data: {date}"),
+    ],
+    signature=(400, 40, 100, 100),
+    missing_signature="[Image not found: Replace with your image path]",
+    check=check_subject_change,
+)
+
+TEMPLATES = {SUBJECT_CHANGE.name: SUBJECT_CHANGE}
+
+
+def fill_form(output, template, values, signature_id=None):
+    """
+    Writes one filled form to `output` (a file name or a binary file object).
+
+    Returns:
+        str: None on success, otherwise the reason the form was refused.
+    """
+    error = template.check(values) if template.check else None
+    if error:
+        return error
+
+    c = canvas.Canvas(output, pagesize=letter)
+    template.draw(c, values, signature_id)
+    c.save()
+    return None
+
+
+def fill_forms(output, requests):
+    """
+    Writes many filled forms into a single PDF, one page each.
+
+    The static part of every template and every distinct signature is
+    stored once in the document and referenced from each page.
+
+    Args:
+        output: File name or binary file object.
+        requests (iterable): (template, values, signature_id) tuples.
+
+    Returns:
+        list: (index, reason) for every request that was refused.
+    """
+    c = canvas.Canvas(output, pagesize=letter)
+    refused = []
+    pages = 0
+    for index, (template, values, signature_id) in enumerate(requests):
+        error = template.check(values) if template.check else None
+        if error:
+            refused.append((index, error))
+            continue
+        template.draw(c, values, signature_id)
+        c.showPage()
+        pages += 1
+    if pages:
         c.save()
-        print(f"PDF generated: {filename}")
+    return refused
+
+
+def fill_named_form(filename, template_name, values, signature_id=None):
+    """
+    fill_form() for background workers: the template is passed by name so
+    the call can be sent to another process, and the PDF is written under a
+    temporary name first so `filename` only ever holds a complete file.
+    """
+    tmp_name = f"{filename}.{os.getpid()}.tmp"
+    error = fill_form(tmp_name, TEMPLATES[template_name], values, signature_id)
+    if error:
+        return error
+    os.replace(tmp_name, filename)
+    return None
+
+
+def generate_pdf(filename, student_first_name, student_last_name, student_addr, student_group, student_id,
+                 subject_list, old_subject, new_subject, new_teacher):
+    values = {
+        "student_first_name": student_first_name,
+        "student_last_name": student_last_name,
+        "student_addr": student_addr,
+        "student_group": student_group,
+        "subject_list": subject_list,
+        "old_subject": old_subject,
+        "new_subject": new_subject,
+        "new_teacher": new_teacher,
+    }
+    error = fill_form(filename, SUBJECT_CHANGE, values, student_id)
+    if error:
+        print(error)
     else:
-        print("Studentul nu are aceasta materie in foaia matricola")
+        print(f"PDF generated: {filename}")
 
 
 def main():
@@ -0,0 +1,107 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class EmbeddingService:
+    """
+    Background encoder that micro-batches requests from many threads.
+
+    submit() returns a Future right away. Worker threads take the first
+    pending text, keep collecting for up to `max_wait` seconds (or until
+    `max_batch_size` texts are waiting) and encode the whole batch with one
+    call, so concurrent requests share a forward pass instead of each
+    running their own.
+
+    Args:
+        encode (callable): Maps a list of texts to an array of embeddings.
+        max_batch_size (int): Most texts encoded together.
+        max_wait (float): Seconds to wait for a batch to fill up.
+        max_queue (int): Pending texts accepted before submit() raises
+            queue.Full, so a burst can't grow memory without bound.
+        workers (int): Number of encoding threads.
+    """
+
+    def __init__(self, encode, max_batch_size=32, max_wait=0.005, max_queue=1024, workers=1):
+        self.encode = encode
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.encoded = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f'embedding-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, text):
+        """
+        Queues `text` for encoding.
+
+        Returns:
+            Future: Resolves to the embedding of `text`.
+
+        Raises:
+            queue.Full: If `max_queue` texts are already waiting.
+            RuntimeError: If the service has been shut down.
+        """
+        if self._stopped.is_set():
+            raise RuntimeError("Embedding service is shut down")
+        future = Future()
+        self._queue.put_nowait((text, future))
+        return future
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Let the other workers see the shutdown marker too
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self._queue.put(None)
+                return
+
+            # Drop requests whose caller already gave up
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.encode([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.encoded += len(batch)
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+    def shutdown(self, wait=True):
+        self._stopped.set()
+        self._queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+from contextlib import contextmanager
+
+import sqlalchemy as sa
+from sqlalchemy import event
+
+from config import SQLITE_PRAGMAS, apply_sqlite_pragmas
+
+INSTANCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+# An explicit FAQ_DATABASE (a file path or a database URL) wins over the
+# database the FAQ store is given, e.g. the app's DATABASE_URL
+DEFAULT_DATABASE = os.path.join(INSTANCE_DIR, 'database.db')
+
+TABLES = ('faq', 'rejected_faq')
+
+metadata = sa.MetaData()
+faq_table = sa.Table(
+    'faq', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('question', sa.Text, nullable=False, unique=True),
+    sa.Column('answer', sa.Text, nullable=False),
+    sqlite_autoincrement=True,
+)
+rejected_table = sa.Table(
+    'rejected_faq', metadata,
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('question', sa.Text, nullable=False),
+    sa.Column('answer', sa.Text, nullable=False),
+    sa.Column('frequency', sa.Integer, nullable=False, server_default='1'),
+    # 0 until process_rejections() has merged it into a cluster
+    sa.Column('clustered', sa.Integer, nullable=False, server_default='1'),
+    sqlite_autoincrement=True,
+)
+
+
+def database_url(database=None):
+    """
+    Returns the URL of the FAQ store: FAQ_DATABASE if it is set, else
+    `database` (a URL or an SQLite file path), else instance/database.db.
+    """
+    database = str(os.environ.get('FAQ_DATABASE') or database or DEFAULT_DATABASE)
+    if '://' not in database:
+        return f"sqlite:///{os.path.abspath(database)}"
+    url = sa.engine.make_url(database)
+    if url.get_backend_name() == 'sqlite' and url.database and not os.path.isabs(url.database):
+        # Relative to the instance folder, as in the app's DATABASE_URL
+        url = url.set(database=os.path.join(INSTANCE_DIR, url.database))
+    return url.render_as_string(hide_password=False)
+
+
+class FaqStore:
+    """
+    FAQ and rejected-question storage in the app's database: SQLite for a
+    single node, or the PostgreSQL database several nodes share.
+
+    Every change is a single-row statement or a short transaction that
+    locks what it reads first (BEGIN IMMEDIATE on SQLite, SELECT ... FOR
+    UPDATE on PostgreSQL), so concurrent workers serialize instead of
+    overwriting each other's copy of a JSON file.
+    """
+
+    def __init__(self, database=None, timeout=30):
+        self.url = database_url(database)
+        self.timeout = timeout
+        url = sa.engine.make_url(self.url)
+        if url.get_backend_name() == 'sqlite':
+            # Embedding sidecars are kept next to the database file
+            self.directory = os.path.dirname(url.database)
+            os.makedirs(self.directory, exist_ok=True)
+            self.engine = sa.create_engine(url)
+            self._install_sqlite_transactions()
+        elif url.get_backend_name() == 'postgresql':
+            self.directory = INSTANCE_DIR
+            os.makedirs(self.directory, exist_ok=True)
+            self.engine = sa.create_engine(url, pool_pre_ping=True)
+        else:
+            raise ValueError(f"The FAQ store needs SQLite or PostgreSQL, not {url.get_backend_name()}")
+
+        metadata.create_all(self.engine)
+        columns = {column['name'] for column in sa.inspect(self.engine).get_columns('rejected_faq')}
+        if 'clustered' not in columns:
+            # Rows from before were clustered as they were recorded
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql(
+                    "ALTER TABLE rejected_faq ADD COLUMN clustered INTEGER NOT NULL DEFAULT 1")
+
+    def _install_sqlite_transactions(self):
+        timeout = self.timeout
+
+        @event.listens_for(self.engine, 'connect')
+        def on_connect(dbapi_connection, connection_record):
+            # Transactions are started by on_begin() below, not by sqlite3
+            dbapi_connection.isolation_level = None
+            # Same WAL / sync settings as the app's connections to this file
+            apply_sqlite_pragmas(dbapi_connection, dict(SQLITE_PRAGMAS, busy_timeout=int(timeout * 1000)))
+
+        @event.listens_for(self.engine, 'begin')
+        def on_begin(connection):
+            # Writers take the lock up front, so two of them can't both read
+            # and then deadlock upgrading to a write
+            immediate = connection.get_execution_options().get('immediate', False)
+            connection.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
+    @contextmanager
+    def _writing(self):
+        with self.engine.connect() as connection:
+            connection.execution_options(immediate=True)
+            with connection.begin():
+                yield connection
+
+    def _insert_ignoring_duplicates(self, table):
+        if self.engine.dialect.name == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+
+    def close(self):
+        """
+        Closes the pooled connections; the next call opens new ones. A
+        pre-fork server calls it before forking, so no worker inherits an
+        open connection.
+        """
+        self.engine.dispose()
+
+    def entries(self, table):
+        """
+        Returns the rows of `table` ('faq' or 'rejected_faq') as dicts, in
+        insertion order.
+        """
+        if table not in TABLES:
+            raise ValueError(f"Unknown FAQ table '{table}'")
+        table = metadata.tables[table]
+        with self.engine.connect() as connection:
+            rows = connection.execute(sa.select(table).order_by(table.c.id))
+            return [dict(row._mapping) for row in rows]
+
+    def is_empty(self):
+        with self.engine.connect() as connection:
+            return all(connection.execute(sa.select(metadata.tables[table].c.id).limit(1)).first() is None
+                       for table in TABLES)
+
+    def add_faq(self, question, answer):
+        """
+        Adds a FAQ entry. Returns False if the question is already there.
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(self._insert_ignoring_duplicates(faq_table),
+                                        {'question': question, 'answer': answer})
+            return result.rowcount == 1
+
+    def add_rejected(self, question, answer):
+        """
+        Records a question the FAQ could not answer, to be clustered later.
+        Returns its id.
+        """
+        with self.engine.begin() as connection:
+            result = connection.execute(rejected_table.insert().values(
+                question=question, answer=answer, frequency=1, clustered=0))
+            return result.inserted_primary_key[0]
+
+    def cluster_rejected(self, pending, merged, added, promote_at):
+        """
+        Applies one clustering round in a single transaction: rejections in
+        `merged` are deleted, the frequency of their clusters grows by
+        `added` ({id: count}), the rest of `pending` is marked clustered,
+        and every touched cluster asked `promote_at` times moves to the FAQ.
+
+        Returns:
+            list: The promoted rows, as dicts. None if some of `pending`
+            was already clustered by another process; nothing is changed
+            then.
+        """
+        table = rejected_table
+        with self._writing() as connection:
+            # Locked, so a round running at the same time waits and then
+            # finds them clustered
+            still_pending = connection.execute(
+                sa.select(table.c.id).where(table.c.clustered == 0, table.c.id.in_(pending))
+                .with_for_update()).all()
+            if len(still_pending) != len(pending):
+                connection.rollback()
+                return None
+
+            for rejected_id, count in added.items():
+                connection.execute(table.update().where(table.c.id == rejected_id)
+                                   .values(frequency=table.c.frequency + count))
+            if merged:
+                connection.execute(table.delete().where(table.c.id.in_(merged)))
+            connection.execute(table.update().where(table.c.id.in_(pending)).values(clustered=1))
+
+            touched = set(pending) - set(merged) | set(added)
+            promoted = [dict(row._mapping) for row in connection.execute(
+                sa.select(table).where(table.c.frequency >= promote_at, table.c.id.in_(touched))
+                .order_by(table.c.id))]
+            if promoted:
+                connection.execute(self._insert_ignoring_duplicates(faq_table),
+                                   [{'question': row['question'], 'answer': row['answer']} for row in promoted])
+                connection.execute(table.delete().where(table.c.id.in_([row['id'] for row in promoted])))
+        return promoted
+
+    def migrate_from_json(self, faq_file='faq.json', rejected_file='rejected_faq.json'):
+        """
+        Imports the legacy JSON files. Returns the number of rows added per
+        table; FAQ questions that are already stored are skipped.
+        """
+        counts = {}
+        with self._writing() as connection:
+            for table, file_name in (('faq', faq_file), ('rejected_faq', rejected_file)):
+                counts[table] = 0
+                if not file_name or not os.path.exists(file_name):
+                    continue
+                with open(file_name, 'r') as file:
+                    data = json.load(file)
+                for entry in data.get(table, []):
+                    if table == 'faq':
+                        result = connection.execute(self._insert_ignoring_duplicates(faq_table),
+                                                    {'question': entry['question'], 'answer': entry['answer']})
+                    else:
+                        result = connection.execute(rejected_table.insert().values(
+                            question=entry['question'], answer=entry['answer'],
+                            frequency=entry.get('frequency', 1)))
+                    counts[table] += result.rowcount
+        return counts
+
+    def export_json(self, table, file_name):
+        """
+        Writes `table` back out in the legacy JSON layout.
+        """
+        entries = self.entries(table)
+        if table == 'faq':
+            entries = [{"question": x['question'], "answer": x['answer']} for x in entries]
+        else:
+            entries = [{"question": x['question'], "answer": x['answer'], "frequency": x['frequency']}
+                       for x in entries]
+        with open(file_name, 'w') as file:
+            json.dump({table: entries}, file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the FAQ tables.")
+    parser.add_argument('--database', help="SQLite file or database URL (default FAQ_DATABASE, then "
+                                           "DATABASE_URL, then instance/database.db)")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate = commands.add_parser('migrate', help="Import faq.json and rejected_faq.json")
+    migrate.add_argument('--faq', default='faq.json')
+    migrate.add_argument('--rejected', default='rejected_faq.json')
+    export = commands.add_parser('export', help="Write the tables back to JSON")
+    export.add_argument('--faq', default='faq.json')
+    export.add_argument('--rejected', default='rejected_faq.json')
+    args = parser.parse_args()
+
+    store = FaqStore(args.database or os.environ.get('DATABASE_URL'))
+    if args.command == 'migrate':
+        counts = store.migrate_from_json(args.faq, args.rejected)
+        print(f"Imported {counts['faq']} FAQ entries and {counts['rejected_faq']} rejected questions.")
+    else:
+        store.export_json('faq', args.faq)
+        store.export_json('rejected_faq', args.rejected)
+        print(f"Exported to {args.faq} and {args.rejected}.")
+
+
+if __name__ == "__main__":
+    main()
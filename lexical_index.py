@@ -0,0 +1,81 @@
+import heapq
+import re
+from collections import Counter, defaultdict
+from itertools import chain
+
+from query_cache import normalize_question
+
+NGRAM_SIZE = 3
+
+
+def normalize_text(text):
+    """
+    normalize_question() without punctuation, so "Where are my grades?"
+    and "where are my grades" compare equal.
+    """
+    return ' '.join(re.findall(r'\w+', normalize_question(text)))
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    """
+    The set of character n-grams of normalized `text`, padded so word
+    boundaries count too.
+    """
+    padded = f" {text} "
+    return {padded[i:i + size] for i in range(max(1, len(padded) - size + 1))}
+
+
+class LexicalIndex:
+    """
+    Character n-gram index over short texts, to find exact and near-exact
+    duplicates of a question without running a model.
+
+    Texts are compared on their sets of character trigrams with the Dice
+    coefficient, 2 * shared / (grams of one + grams of the other): 1.0 for
+    the same text after normalization, 0.8-0.95 for a typo or a missing word
+    in a sentence-long question, and dropping quickly from there. Only
+    texts that share a trigram with the query are scored, found through an
+    inverted index.
+    """
+
+    def __init__(self, texts=()):
+        self.build(texts)
+
+    def build(self, texts):
+        self.sizes = []
+        self.postings = defaultdict(list)
+        self.exact = {}
+        self.add(texts)
+
+    def add(self, texts):
+        """
+        Appends `texts`, at positions following the current ones.
+        """
+        for text in texts:
+            position = len(self.sizes)
+            normalized = normalize_text(text)
+            grams = ngrams(normalized)
+            self.exact.setdefault(normalized, position)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings[gram].append(position)
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def search(self, text, top_k=2):
+        """
+        Returns:
+            list: Up to `top_k` (position, score) pairs, best first.
+        """
+        normalized = normalize_text(text)
+        grams = ngrams(normalized)
+        shared = Counter(chain.from_iterable(self.postings[gram] for gram in grams if gram in self.postings))
+        scored = ((position, 2 * count / (len(grams) + self.sizes[position])) for position, count in shared.items())
+        best = heapq.nlargest(top_k, scored, key=lambda match: match[1])
+
+        # The same normalized text always wins, even over a duplicate of it
+        exact = self.exact.get(normalized)
+        if exact is not None and (not best or best[0][0] != exact):
+            best = [(exact, 1.0)] + [match for match in best if match[0] != exact][:top_k - 1]
+        return best
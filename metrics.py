@@ -0,0 +1,285 @@
+import cProfile
+import math
+import os
+import random
+import re
+import threading
+import time
+
+# Upper bounds of the histogram buckets, +Inf is always added
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Value that only goes up, one per combination of label values.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    """
+    Distribution of observed values in cumulative buckets, one per
+    combination of label values.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (f'{self.name}_bucket',
+                       _format_labels(self.labels, key, [('le', _format_value(bound))]), cumulative)
+            yield f'{self.name}_sum', _format_labels(self.labels, key), total
+            yield f'{self.name}_count', _format_labels(self.labels, key), cumulative
+
+
+class Registry:
+    """
+    The metrics of a process, rendered in the Prometheus text format.
+
+    Values are kept per process: behind a server with several worker
+    processes every worker reports its own, and Prometheus (or whatever
+    scrapes them) adds them up.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._caches = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=SECONDS_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def add_cache(self, name, cache):
+        """
+        Reports the hits and misses of `cache`, anything with `hits` and
+        `misses` attributes, under cache="name". A callable returning such
+        caches can be passed instead, for caches created later.
+        """
+        with self._lock:
+            self._caches.append((name, cache))
+
+    def _cache_samples(self):
+        totals = {}
+        for name, caches in self._caches:
+            caches = caches() if callable(caches) else [caches]
+            hits, misses = totals.get(name, (0, 0))
+            for cache in caches:
+                hits, misses = hits + cache.hits, misses + cache.misses
+            totals[name] = (hits, misses)
+
+        lines = ['# HELP cache_requests_total Cache lookups by result.',
+                 '# TYPE cache_requests_total counter']
+        for name, (hits, misses) in sorted(totals.items()):
+            lines.append(f'cache_requests_total{{cache="{name}",result="hit"}} {hits}')
+            lines.append(f'cache_requests_total{{cache="{name}",result="miss"}} {misses}')
+        lines += ['# HELP cache_hit_ratio Share of cache lookups that were hits since the process started.',
+                  '# TYPE cache_hit_ratio gauge']
+        for name, (hits, misses) in sorted(totals.items()):
+            ratio = hits / (hits + misses) if hits + misses else 0.0
+            lines.append(f'cache_hit_ratio{{cache="{name}"}} {ratio!r}')
+        return lines
+
+    def render(self):
+        """
+        Returns every metric as Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        if self._caches:
+            lines += self._cache_samples()
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to handle a request, by endpoint.',
+    ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = REGISTRY.histogram(
+    'http_request_db_queries', 'SQL statements run by a request.', ('endpoint',), QUERY_BUCKETS)
+REQUEST_QUERY_SECONDS = REGISTRY.histogram(
+    'http_request_db_seconds', 'Time a request spent running SQL statements.', ('endpoint',))
+DB_QUERIES = REGISTRY.counter('db_queries_total', 'SQL statements run, in and out of requests.')
+DB_QUERY_SECONDS = REGISTRY.counter('db_query_seconds_total', 'Time spent running SQL statements.')
+ENCODE_SECONDS = REGISTRY.histogram('sbert_encode_seconds', 'Time of one SBERT model encode call.')
+ENCODE_BATCH_SIZE = REGISTRY.histogram(
+    'sbert_encode_batch_size', 'Texts encoded by one SBERT model call.', buckets=BATCH_BUCKETS)
+FAQ_LOOKUPS = REGISTRY.counter(
+    'faq_lookups_total', 'FAQ lookups not served from the cache, by the stage that answered them.', ('stage',))
+PDF_RENDER_SECONDS = REGISTRY.histogram(
+    'pdf_render_seconds', 'Time to render one PDF, by document.', ('document',))
+
+
+def timed_call(function, *args):
+    """
+    Calls function(*args) and returns (result, seconds). Module-level so it
+    can wrap jobs sent to a process pool, whose metrics would otherwise
+    stay in the worker process.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+# SQL statements of the request being handled by the current thread
+_request = threading.local()
+
+
+def install_query_timer(engine):
+    """
+    Counts and times every statement `engine` runs, adding them to the
+    current request's totals when there is one.
+    """
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._metrics_start
+        DB_QUERIES.inc()
+        DB_QUERY_SECONDS.inc(seconds)
+        if getattr(_request, 'active', False):
+            _request.queries += 1
+            _request.query_seconds += seconds
+
+
+def _profile_name(endpoint, seconds):
+    endpoint = re.sub(r'[^A-Za-z0-9_.-]', '_', endpoint)
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{endpoint}-{seconds * 1000:.0f}ms.prof"
+
+
+def init_app(app, engine):
+    """
+    Records request latency and SQL statements per endpoint, and serves
+    every metric on GET /metrics.
+
+    When PROFILE_SAMPLE_RATE is above 0, that share of requests runs under
+    cProfile, and the profiles of those slower than PROFILE_SLOW_SECONDS
+    are written to PROFILE_DIR as .prof files (open them with
+    `python -m pstats` or snakeviz).
+    """
+    from flask import Response, g, request
+
+    install_query_timer(engine)
+
+    @app.before_request
+    def start_request_metrics():
+        _request.active = True
+        _request.queries = 0
+        _request.query_seconds = 0.0
+        g.metrics_profiler = None
+        rate = app.config['PROFILE_SAMPLE_RATE']
+        if rate and random.random() < rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another profiler is already running in this process
+                pass
+            else:
+                g.metrics_profiler = profiler
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def remember_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(error):
+        if 'metrics_start' not in g:
+            return
+        seconds = time.perf_counter() - g.metrics_start
+        endpoint = request.endpoint or 'unmatched'
+        status = g.get('metrics_status', 500)
+        REQUEST_SECONDS.observe(seconds, endpoint=endpoint, method=request.method, status=status)
+        REQUEST_QUERIES.observe(_request.queries, endpoint=endpoint)
+        REQUEST_QUERY_SECONDS.observe(_request.query_seconds, endpoint=endpoint)
+        _request.active = False
+
+        profiler = g.metrics_profiler
+        if profiler is not None:
+            profiler.disable()
+            if seconds >= app.config['PROFILE_SLOW_SECONDS']:
+                os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+                profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], _profile_name(endpoint, seconds)))
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
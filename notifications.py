@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+from collections import defaultdict
+
+# Largest message the local broker sends, in bytes of JSON
+MAX_MESSAGE_BYTES = 65536
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Messages published on one channel since subscribe(), in order.
+
+    At most `max_pending` wait to be read; when a reader falls that far
+    behind, newer messages are dropped for it rather than buffered without
+    bound.
+    """
+
+    def __init__(self, broker, channel, max_pending):
+        self.broker = broker
+        self.channel = channel
+        self.closed = False
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """
+        Returns the next message, or None after `timeout` seconds without
+        one or once the subscription is closed.
+        """
+        if self.closed:
+            return None
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+            # Wake a reader blocked in get()
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                pass
+
+
+class MemoryBroker:
+    """
+    Publish/subscribe between the threads of one process.
+
+    Messages are JSON-serializable dicts, delivered to every subscription
+    of their channel that exists when they are published; nothing is
+    stored for subscribers that connect later.
+    """
+
+    name = 'memory'
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel, self.max_pending)
+        with self._lock:
+            if self.closed:
+                subscription.closed = True
+            else:
+                self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+    def publish(self, channel, message):
+        self._deliver(channel, message)
+
+    def close(self):
+        """
+        Closes every subscription, so the readers waiting on them return.
+        Subscriptions made afterwards start closed.
+        """
+        with self._lock:
+            self.closed = True
+            subscriptions = [s for channel in self._subscriptions.values() for s in channel]
+        for subscription in subscriptions:
+            subscription.close()
+
+
+class LocalBroker(MemoryBroker):
+    """
+    Publish/subscribe between the processes of one host, e.g. the workers
+    of serve.py.
+
+    Every process binds a Unix datagram socket in `directory`; publish()
+    sends the message to each socket there and a thread in every process
+    hands what arrives to that process's subscribers. Sockets left behind
+    by processes that exited are removed on the next publish().
+    """
+
+    name = 'local'
+
+    def __init__(self, directory, max_pending=100):
+        super().__init__(max_pending)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            # Left by an earlier process with the same pid
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+        self._thread = threading.Thread(target=self._listen, name='notification-listener', daemon=True)
+        self._thread.start()
+
+    def _listen(self):
+        while True:
+            data = self._socket.recv(MAX_MESSAGE_BYTES)
+            if self.closed:
+                break
+            try:
+                channel, message = json.loads(data)
+            except ValueError:
+                continue
+            self._deliver(channel, message)
+        self._socket.close()
+
+    def publish(self, channel, message):
+        data = json.dumps([channel, message]).encode('utf-8')
+        if len(data) > MAX_MESSAGE_BYTES:
+            logger.warning("Dropping a %d byte message on %s, over MAX_MESSAGE_BYTES", len(data), channel)
+            return
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            # Never wait on a process that stopped reading
+            sender.setblocking(False)
+            for name in os.listdir(self.directory):
+                if not name.endswith('.sock'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    sender.sendto(data, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Nobody listens there any more
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                except BlockingIOError:
+                    logger.warning("Notification queue of %s is full, dropping a message", name)
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        # Wake the listener, which closes the socket
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sender:
+            sender.sendto(b'', self.path)
+        os.remove(self.path)
+
+
+BROKERS = {
+    MemoryBroker.name: MemoryBroker,
+    LocalBroker.name: LocalBroker,
+}
+
+
+def make_broker(name, **options):
+    """
+    Creates a broker by name, 'memory' or 'local' (which needs `directory`).
+    """
+    if name not in BROKERS:
+        raise ValueError(f"Unknown notification broker '{name}', expected one of {sorted(BROKERS)}")
+    return BROKERS[name](**options)
@@ -0,0 +1,64 @@
+import glob
+import hashlib
+import json
+import os
+
+
+class PdfCache:
+    """
+    Generated PDFs on disk, one file per owner and content key.
+
+    The key is a hash of everything the document is rendered from, so a
+    stale file is never served: when the data changes the key changes.
+    invalidate() only reclaims the space of an owner's old files.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(*parts):
+        """
+        Hashes JSON-serializable `parts` into a cache key (also used as ETag).
+        """
+        payload = json.dumps(parts, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def path(self, owner, key):
+        return os.path.join(self.directory, f"{owner}-{key}.pdf")
+
+    def get(self, owner, key):
+        """
+        Returns the path of the cached PDF, or None if it isn't cached.
+        """
+        path = self.path(owner, key)
+        if os.path.exists(path):
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def put(self, owner, key, data):
+        path = self.path(owner, key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def invalidate(self, owner, keep=None):
+        """
+        Removes the owner's cached PDFs, except the one for key `keep`.
+        A reader that looked a file up just before may find it gone.
+        """
+        kept = self.path(owner, keep) if keep is not None else None
+        for path in glob.glob(os.path.join(glob.escape(self.directory), f"{owner}-*.pdf")):
+            if path == kept:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
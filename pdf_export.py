@@ -0,0 +1,68 @@
+import zipfile
+from collections import deque
+
+
+def render_pdf(html):
+    """
+    Renders an HTML document to PDF bytes. Runs in the export worker
+    processes, so it uses WeasyPrint directly rather than through Flask.
+    """
+    from weasyprint import HTML
+
+    return HTML(string=html).write_pdf()
+
+
+def ordered_map(pool, function, items, window):
+    """
+    Like pool.map(), but keeps at most `window` items in flight and yields
+    results in input order as they complete, so a large input is never
+    submitted (or held in memory) all at once.
+
+    `items` yields (key, argument) pairs; results come back as
+    (key, result) pairs.
+    """
+    pending = deque()
+    for key, argument in items:
+        pending.append((key, pool.submit(function, argument)))
+        if len(pending) >= window:
+            key, future = pending.popleft()
+            yield key, future.result()
+    while pending:
+        key, future = pending.popleft()
+        yield key, future.result()
+
+
+class _StreamBuffer:
+    """
+    Write-only file object that hands out what has been written so far.
+    zipfile falls back to streaming mode because it can't seek in it.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """
+    Builds a ZIP archive from (name, bytes) pairs, yielding it chunk by
+    chunk, so only the entry being added is held in memory.
+    """
+    buffer = _StreamBuffer()
+    # PDFs are already compressed, storing them saves CPU for nothing lost
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for name, data in entries:
+            archive.writestr(name, data)
+            yield buffer.drain()
+    yield buffer.drain()
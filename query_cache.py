@@ -0,0 +1,72 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_question(text):
+    """
+    Folds case, diacritics and whitespace so trivially different spellings
+    of a question share a cache entry ("Unde îmi văd  notele?" and
+    "unde imi vad notele?" map to the same key).
+    """
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r'\s+', ' ', stripped).strip().casefold()
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache with a time-to-live, keyed on normalized question
+    text.
+
+    Args:
+        max_size (int): Entries kept before the least recently used is evicted.
+        ttl (float): Seconds an entry stays valid, None to never expire.
+    """
+
+    def __init__(self, max_size=1024, ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, question):
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, question, value):
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, question):
+        with self._lock:
+            self._entries.pop(normalize_question(question), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
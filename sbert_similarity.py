@@ -1,106 +1,875 @@
-from sentence_transformers import SentenceTransformer, util
+import argparse
+import glob
+from collections import deque
+import hashlib
 import os
-import torch
+import sys
+import threading
 import json
+import logging
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import numpy as np
+import metrics
+from embedding_worker import EmbeddingService
+from faq_store import FaqStore
+from lexical_index import LexicalIndex
+from query_cache import QueryCache
+from similarity_backends import STORAGE_DTYPES, dequantize, dot, make_backend, quantize
+
+MODEL_NAME = 'sentence-transformers/paraphrase-MiniLM-L6-v2'
+SIMILARITY_THRESHOLD = 0.5
+BATCH_SIZE = 64
+QUERY_CACHE_SIZE = 4096
+QUERY_CACHE_TTL = 3600
+PROMOTION_FREQUENCY = 3
+# Hex digits of the content hash in embedding sidecar names
+HASH_LENGTH = 16
+# A question whose characters almost all match a stored one is answered by
+# the lexical index without the model: its best trigram score must reach
+# LEXICAL_THRESHOLD and beat the runner-up by LEXICAL_MARGIN (an exact
+# match after normalization always does). Above 1 turns this off
+LEXICAL_THRESHOLD = float(os.environ.get('FAQ_LEXICAL_THRESHOLD', 0.85))
+LEXICAL_MARGIN = 0.1
+
+# Background encoder used by the web app (see get_embedding_service)
+EMBEDDING_MAX_BATCH = 32
+EMBEDDING_MAX_WAIT = 0.005
+EMBEDDING_QUEUE_SIZE = 1024
+FAQ_MATCH_TIMEOUT = 2.0
+# Seconds before loading the FAQ is tried again after it failed
+FAQ_LOAD_RETRY = 300
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'sbert_model')
+MODEL_WEIGHTS = ('model.safetensors', 'pytorch_model.bin')
+ONNX_MODEL = os.path.join(MODEL_DIR, 'onnx', 'model.onnx')
+
+# How the model runs on the CPU:
+#   torch - fp32 PyTorch (default)
+#   int8  - PyTorch with its Linear layers dynamically quantized to int8
+#   onnx  - ONNX Runtime, exported once to models/sbert_model/onnx
+#           (needs `pip install "sentence-transformers[onnx]"`)
+INFERENCE_MODES = ('torch', 'int8', 'onnx')
+INFERENCE = os.environ.get('SBERT_INFERENCE', 'torch')
+# How FAQ embedding matrices are stored in memory and in the sidecars,
+# one of similarity_backends.STORAGE_DTYPES
+EMBEDDING_DTYPE = os.environ.get('FAQ_EMBEDDING_DTYPE', 'float32')
+
+if INFERENCE not in INFERENCE_MODES:
+    raise ValueError(f"Unknown SBERT_INFERENCE '{INFERENCE}', expected one of {INFERENCE_MODES}")
+if EMBEDDING_DTYPE not in STORAGE_DTYPES:
+    raise ValueError(f"Unknown FAQ_EMBEDDING_DTYPE '{EMBEDDING_DTYPE}', expected one of {STORAGE_DTYPES}")
+
+# Shared by every thread of the process, created on first use by get_model()
+_model = None
+_model_lock = threading.Lock()
+
+# Loaded FAQ indexes, keyed by the FAQ table they mirror
+_indexes = {}
+_store = None
+_store_database = None
+_store_lock = threading.Lock()
+_embedding_service = None
+_entries = {}
+_jobs_thread = None
+_jobs_stopped = threading.Event()
+_faq_loader = None
+_faq_failed_at = None
+_faq_ready = threading.Event()
+
+logger = logging.getLogger(__name__)
+
+# Hits and misses of the question caches of every loaded index
+metrics.REGISTRY.add_cache('faq_query', lambda: [index.cache for index in list(_indexes.values())])
+
+
+def get_model():
+    """
+    Returns the process-wide SBERT model, loading it on first use.
+
+    sentence_transformers (and torch) are only imported here, so importing
+    this module stays cheap. The model is read from models/sbert_model when
+    the weights are there, otherwise it is fetched once and saved there.
+    It runs as set by SBERT_INFERENCE.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import SentenceTransformer
+
+                local = any(os.path.exists(os.path.join(MODEL_DIR, name)) for name in MODEL_WEIGHTS)
+                if INFERENCE == 'onnx':
+                    exported = os.path.exists(ONNX_MODEL)
+                    model = SentenceTransformer(MODEL_DIR if exported or local else MODEL_NAME,
+                                                device='cpu', backend='onnx')
+                    if not exported:
+                        model.save(MODEL_DIR)
+                else:
+                    model = SentenceTransformer(MODEL_DIR if local else MODEL_NAME, device='cpu')
+                    if not local:
+                        model.save(MODEL_DIR)
+                    if INFERENCE == 'int8':
+                        import torch
+
+                        # Weights of the Linear layers (nearly all of the
+                        # compute) become int8, activations are quantized
+                        # on the fly
+                        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                _model = model
+    return _model
+
+
+def encode(texts, **kwargs):
+    """
+    model.encode() with the shared model, recording its time and batch
+    size in the metrics.
+    """
+    model = get_model()
+    start = time.perf_counter()
+    embeddings = model.encode(texts, **kwargs)
+    metrics.ENCODE_SECONDS.observe(time.perf_counter() - start)
+    metrics.ENCODE_BATCH_SIZE.observe(1 if isinstance(texts, str) else len(texts))
+    return embeddings
+
+
+def _encode_batch(texts):
+    return encode(texts, batch_size=len(texts), convert_to_numpy=True, normalize_embeddings=True)
+
+
+def get_embedding_service():
+    """
+    Returns the process-wide background EmbeddingService, starting it on
+    first use.
+    """
+    global _embedding_service
+    if _embedding_service is None:
+        with _model_lock:
+            if _embedding_service is None:
+                _embedding_service = EmbeddingService(_encode_batch, EMBEDDING_MAX_BATCH,
+                                                      EMBEDDING_MAX_WAIT, EMBEDDING_QUEUE_SIZE)
+    return _embedding_service
+
 
-model = SentenceTransformer('sentence-transformers/paraphrase-MiniLM-L6-v2')
-if not os.path.exists('models/sbert_model'):
-    model.save('models/sbert_model')
+def warm_up(faq_files=('faq',)):
+    """
+    Loads the model and the FAQ indexes ahead of time.
+
+    Call it in a pre-fork server's master process: workers forked afterwards
+    share the weights and the memory-mapped embeddings copy-on-write.
+    """
+    import gc
+
+    get_model().encode('warm up')
+    for file_name in faq_files:
+        get_index(file_name).memory_map()
+    get_store().close()
+
+    # Keep the garbage collector from touching (and so copying) the pages
+    # of everything loaded so far once the workers are forked
+    gc.collect()
+    gc.freeze()
+
+
+class FaqIndex:
+    """
+    Normalized embeddings of a list of FAQ questions.
+
+    The matrix is persisted in an .npy sidecar next to the FAQ data, named
+    after a hash of the questions, and memory-mapped back on the next start,
+    so the corpus is encoded once instead of on every lookup. Nearest
+    neighbours are found by a pluggable backend (see similarity_backends).
+    Results of search() are cached per normalized question text until the
+    index changes. The matrix is stored as FAQ_EMBEDDING_DTYPE.
+
+    Single-match lookups first try a character n-gram index of the same
+    questions (see lexical_match()), and only encode the question when it
+    isn't a near-exact copy of a stored one.
+    """
+
+    def __init__(self, file_name, questions, backend=None):
+        self.file_name = file_name
+        self.questions = []
+        self.embeddings = np.empty((0, 0), dtype=EMBEDDING_DTYPE)
+        self.backend = backend or make_backend()
+        self.cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.lexical = LexicalIndex()
+        self._lock = threading.RLock()
+        self.backend.build(self.embeddings)
+        self.sync(questions)
+
+    def _content_hash(self, questions):
+        # Embeddings from another inference mode or storage type live in
+        # their own sidecar; the default keeps the name it always had
+        model_key = MODEL_NAME
+        if (INFERENCE, EMBEDDING_DTYPE) != ('torch', 'float32'):
+            model_key = f"{MODEL_NAME}:{INFERENCE}:{EMBEDDING_DTYPE}"
+        digest = hashlib.sha256(model_key.encode('utf-8'))
+        for question in questions:
+            digest.update(question.encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def _sidecar_prefix(self):
+        # Each inference mode / storage type has its own sidecars, e.g.
+        # faq.int8-float16.<hash>.npy; the default keeps faq.<hash>.npy
+        prefix = os.path.splitext(self.file_name)[0] + '.'
+        if (INFERENCE, EMBEDDING_DTYPE) != ('torch', 'float32'):
+            prefix += f"{INFERENCE}-{EMBEDDING_DTYPE}."
+        return prefix
+
+    def _sidecar_path(self, questions):
+        return f"{self._sidecar_prefix()}{self._content_hash(questions)}.npy"
+
+    def _save(self):
+        path = self._sidecar_path(self.questions)
+        # Every worker may save the same sidecar; each writes its own file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.ascontiguousarray(self.embeddings))
+        os.replace(tmp_path, path)
+
+        # Drop sidecars left behind by older versions of the file, in this
+        # mode only (the hash is HASH_LENGTH hex digits)
+        for stale in glob.glob(glob.escape(self._sidecar_prefix()) + '?' * HASH_LENGTH + '.npy'):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    # Another worker removed it first
+                    pass
+
+    def sync(self, questions):
+        """
+        Brings the index in line with `questions`.
+
+        When another process already wrote the sidecar for the new content
+        it is memory-mapped. Otherwise, if the current questions are a
+        prefix of the new list only the new tail is encoded, or else the
+        whole list is.
+        """
+        questions = list(questions)
+        with self._lock:
+            if questions == self.questions:
+                return
+            self.cache.clear()
+
+            try:
+                embeddings = np.load(self._sidecar_path(questions), mmap_mode='r')
+            except FileNotFoundError:
+                # Not written yet, or already replaced by another worker
+                embeddings = None
+            if embeddings is not None:
+                self.embeddings = embeddings
+                self.questions = questions
+                self.backend.build(self.embeddings)
+                self.lexical.build(questions)
+                return
+
+            count = len(self.questions)
+            if count and questions[:count] == self.questions:
+                self._append(questions[count:])
+                return
+
+            self.questions = []
+            self.embeddings = self.embeddings[:0]
+            self.backend.build(self.embeddings)
+            self.lexical.build([])
+            self._append(questions)
+
+    def _append(self, questions):
+        if not questions:
+            return
+        self.cache.clear()
+        new_rows = quantize(encode(questions, convert_to_numpy=True, normalize_embeddings=True),
+                            EMBEDDING_DTYPE)
+        self.embeddings = np.vstack([self.embeddings, new_rows]) if len(self.embeddings) else new_rows
+        self.questions.extend(questions)
+        self.backend.add(self.embeddings)
+        self.lexical.add(questions)
+        self._save()
+
+    def memory_map(self):
+        """
+        Swaps a matrix held in memory for a read-only memory map of its
+        sidecar. Processes forked afterwards, and any other process loading
+        the same questions, then share one copy in the page cache.
+        """
+        with self._lock:
+            if isinstance(self.embeddings, np.memmap) or not self.questions:
+                return
+            try:
+                self.embeddings = np.load(self._sidecar_path(self.questions), mmap_mode='r')
+            except FileNotFoundError:
+                return
+            self.backend.build(self.embeddings)
+
+    def add(self, question):
+        """
+        Appends one question to the index, encoding only that question.
+        """
+        with self._lock:
+            self._append([question])
+
+    def remove(self, *positions):
+        """
+        Removes the questions at `positions` without re-encoding the rest.
+        """
+        with self._lock:
+            self.cache.clear()
+            positions = sorted(set(positions), reverse=True)
+            self.embeddings = np.delete(self.embeddings, positions, axis=0)
+            # Highest first, so the positions still to remove don't shift
+            for idx in positions:
+                self.questions.pop(idx)
+                self.backend.remove(idx, self.embeddings)
+            self.lexical.build(self.questions)
+            self._save()
+
+    def lexical_match(self, question):
+        """
+        Looks `question` up in the lexical index only.
+
+        Returns:
+            tuple: (index, score) when a stored question is a confident
+            near-exact match (see LEXICAL_THRESHOLD), otherwise None and the
+            model has to decide. The score is the trigram score, not a
+            cosine similarity.
+        """
+        if LEXICAL_THRESHOLD > 1:
+            return None
+        with self._lock:
+            matches = self.lexical.search(question, 2)
+        if not matches or matches[0][1] < LEXICAL_THRESHOLD:
+            return None
+        if matches[0][1] < 1.0 and len(matches) > 1 and matches[0][1] - matches[1][1] < LEXICAL_MARGIN:
+            return None
+        return matches[0]
+
+    def search(self, question):
+        """
+        Finds the stored question closest to `question`.
+
+        Returns:
+            tuple: (index, score) of the best match, or (None, score) when
+            the best score is below the similarity threshold.
+        """
+        if not self.questions:
+            return None, 0.0
+
+        cached = self.cache.get(question)
+        if cached is not None:
+            return cached
+
+        match = self.lexical_match(question)
+        if match is not None:
+            metrics.FAQ_LOOKUPS.inc(stage='lexical')
+            self.cache.put(question, match)
+            return match
+
+        metrics.FAQ_LOOKUPS.inc(stage='model')
+        embedding = encode(question, convert_to_numpy=True, normalize_embeddings=True)
+        return self._search_embedding(question, embedding)
+
+    def search_async(self, question, service):
+        """
+        Like search(), but encodes `question` on an EmbeddingService so it
+        is batched with other pending questions.
+
+        Returns:
+            Future: Resolves to the (index, score) search() would return.
+        """
+        result = Future()
+        if not self.questions:
+            result.set_result((None, 0.0))
+            return result
+
+        cached = self.cache.get(question)
+        if cached is not None:
+            result.set_result(cached)
+            return result
+
+        match = self.lexical_match(question)
+        if match is not None:
+            metrics.FAQ_LOOKUPS.inc(stage='lexical')
+            self.cache.put(question, match)
+            result.set_result(match)
+            return result
+
+        metrics.FAQ_LOOKUPS.inc(stage='model')
+
+        def done(embedding_future):
+            try:
+                result.set_result(self._search_embedding(question, embedding_future.result()))
+            except Exception as e:
+                result.set_exception(e)
+
+        service.submit(question).add_done_callback(done)
+        return result
+
+    def _search_embedding(self, question, embedding):
+        with self._lock:
+            scores, indices = self.backend.search(embedding[None, :], 1)
+        best_idx = int(indices[0, 0])
+        best_score = float(scores[0, 0])
+        result = (best_idx, best_score) if best_idx >= 0 and best_score >= SIMILARITY_THRESHOLD else (None, best_score)
+        self.cache.put(question, result)
+        return result
+
+    def search_many(self, questions, top_k=1, threshold=SIMILARITY_THRESHOLD, batch_size=BATCH_SIZE):
+        """
+        Matches many questions against the index, one batch at a time.
+
+        Each batch is encoded with a single model call and scored by the
+        backend in one go (a single matrix multiply for brute force).
+
+        Yields:
+            list: For every question, up to `top_k` (index, score) pairs
+            scoring at least `threshold`, best first.
+        """
+        top_k = min(top_k, len(self.questions))
+        batch = []
+        for question in questions:
+            batch.append(question)
+            if len(batch) == batch_size:
+                yield from self._search_batch(batch, top_k, threshold)
+                batch = []
+        if batch:
+            yield from self._search_batch(batch, top_k, threshold)
+
+    def _search_batch(self, questions, top_k, threshold):
+        if top_k <= 0:
+            for _ in questions:
+                yield []
+            return
+
+        # Exact copies of a stored question (after normalization) skip the
+        # model when only the best match is wanted. Near-exact ones don't:
+        # their trigram score can't be held against the cosine `threshold`
+        # or reported next to cosine scores. An exact copy counts as cosine
+        # 1.0, which passes any threshold
+        matches = [None] * len(questions)
+        if top_k == 1:
+            for i, question in enumerate(questions):
+                match = self.lexical_match(question)
+                if match is not None and match[1] >= 1.0:
+                    matches[i] = [(match[0], 1.0)]
+        rest = [i for i, found in enumerate(matches) if found is None]
+        metrics.FAQ_LOOKUPS.inc(len(questions) - len(rest), stage='lexical')
+        metrics.FAQ_LOOKUPS.inc(len(rest), stage='model')
+
+        if rest:
+            embeddings = encode([questions[i] for i in rest], batch_size=len(rest),
+                                convert_to_numpy=True, normalize_embeddings=True)
+            for i, found in zip(rest, self.rank(embeddings, top_k, threshold)):
+                matches[i] = found
+        yield from matches
+
+    def rank(self, embeddings, top_k=1, threshold=SIMILARITY_THRESHOLD):
+        """
+        Scores already encoded questions against the index.
+
+        Returns:
+            list: For every row of `embeddings`, up to `top_k` (index, score)
+            pairs scoring at least `threshold`, best first.
+        """
+        with self._lock:
+            top_k = min(top_k, len(self.questions))
+            if top_k <= 0:
+                return [[] for _ in embeddings]
+            scores, indices = self.backend.search(embeddings, top_k)
+
+        return [[(int(idx), float(score)) for idx, score in zip(row_indices, row_scores)
+                 if idx >= 0 and score >= threshold]
+                for row_scores, row_indices in zip(scores, indices)]
+
+
+def use_database(database):
+    """
+    Keeps the FAQ in `database` (a URL or an SQLite file), normally the
+    app's own database, unless FAQ_DATABASE says otherwise. Call it before
+    the store is first used.
+    """
+    global _store_database
+    _store_database = database
+
+
+def get_store():
+    """
+    Returns the FAQ store, importing faq.json and rejected_faq.json the
+    first time it is opened empty.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = FaqStore(_store_database or os.environ.get('DATABASE_URL'))
+                if store.is_empty():
+                    here = os.path.dirname(os.path.abspath(__file__))
+                    store.migrate_from_json(os.path.join(here, 'faq.json'), os.path.join(here, 'rejected_faq.json'))
+                _store = store
+    return _store
+
+
+def get_index(file_name):
+    """
+    Returns the index for a FAQ table, loading it on first use.
+    """
+    key = file_name.split('.')[0]
+    if key not in _indexes:
+        get_faqs(key)
+    return _indexes[key]
+
+
+def sync_index(file_name, questions):
+    """
+    Creates or updates the index for a FAQ table so it mirrors `questions`.
+    The embedding sidecar is kept next to the database.
+    """
+    key = file_name.split('.')[0]
+    if key in _indexes:
+        _indexes[key].sync(questions)
+    else:
+        _indexes[key] = FaqIndex(os.path.join(get_store().directory, key), questions)
+    return _indexes[key]
 
 
 def compute_similarity(question, questions):
     """
-    Computes cosine similarity between two sentences.
+    Computes cosine similarity between a question and a list of questions.
 
     Args:
-        sentence1 (str): First sentence.
-        sentence2 (str): Second sentence.
+        question (str): The incoming question.
+        questions (list | FaqIndex): Stored questions. Passing a FaqIndex
+            only encodes `question`; a plain list is encoded on every call.
 
     Returns:
-        float: Cosine similarity score between -1 and 1.
+        tuple: (index, score) of the best match, or (None, score) when the
+        best score is below the similarity threshold.
     """
-    embedding1 = model.encode(question, convert_to_tensor=True)
-    embedding2 = model.encode(questions, convert_to_tensor=True)
+    if isinstance(questions, FaqIndex):
+        return questions.search(question)
+
+    from sentence_transformers import util
+
+    embedding1 = encode(question, convert_to_tensor=True)
+    embedding2 = encode(questions, convert_to_tensor=True)
 
     similarity = util.pytorch_cos_sim(embedding1, embedding2)
-    if similarity.max().item() >= 0.5:
+    if similarity.max().item() >= SIMILARITY_THRESHOLD:
         return similarity.argmax().item(), similarity.max().item()
     return None, similarity.max().item()
 
 
+def match_many(questions, top_k=1, threshold=SIMILARITY_THRESHOLD, batch_size=BATCH_SIZE,
+               file_name='faq'):
+    """
+    Matches a stream of questions against the FAQ in batches.
+
+    Args:
+        questions (iterable): Questions to match.
+        top_k (int): Number of matches to return per question.
+        threshold (float): Minimum score for a match to be returned.
+        batch_size (int): Number of questions encoded per model call.
+        file_name (str): FAQ table to match against.
+
+    Yields:
+        tuple: (question, matches), where matches is a list of
+        (index, score) pairs, best first.
+    """
+    faq_index = get_index(file_name)
+
+    # Keep the questions of the current batch around so results can be
+    # paired with their question without materializing the whole input
+    pending = deque()
+
+    def feed():
+        for question in questions:
+            pending.append(question)
+            yield question
+
+    for matches in faq_index.search_many(feed(), top_k, threshold, batch_size):
+        yield pending.popleft(), matches
+
+
+def load_faq_in_background():
+    """
+    Loads the model and the FAQ index on a daemon thread, once per process,
+    so the first lookup doesn't load them on a request thread. After a
+    failed load nothing is tried for FAQ_LOAD_RETRY seconds.
+
+    Returns:
+        threading.Event: Set once the FAQ can be searched.
+    """
+    global _faq_loader
+    with _store_lock:
+        if 'faq' in _indexes and _model is not None:
+            # Loaded by warm_up() or the command line
+            _faq_ready.set()
+        elif _faq_loader is None and (_faq_failed_at is None
+                                      or time.monotonic() - _faq_failed_at >= FAQ_LOAD_RETRY):
+            _faq_loader = threading.Thread(target=_load_faq, name='faq-loader', daemon=True)
+            _faq_loader.start()
+    return _faq_ready
+
+
+def _load_faq():
+    global _faq_loader, _faq_failed_at
+    try:
+        get_index('faq')
+        get_model()
+    except Exception:
+        logger.exception("Loading the FAQ failed, trying again in %d seconds", FAQ_LOAD_RETRY)
+        with _store_lock:
+            _faq_failed_at = time.monotonic()
+            _faq_loader = None
+        return
+    _faq_ready.set()
+
+
+def _check_faq_ready():
+    """
+    Raises right away, rather than waiting, while the FAQ isn't loaded.
+    """
+    if not load_faq_in_background().is_set():
+        raise FutureTimeoutError("The FAQ is still loading")
+
+
+def faq_answer(question, timeout=FAQ_MATCH_TIMEOUT):
+    """
+    Answers `question` from the FAQ without encoding it on the calling
+    thread: the question is handed to the background embedding service and
+    batched with whatever other requests are pending.
+
+    Returns:
+        tuple: (answer, score), answer is None when no FAQ entry matches.
+
+    Raises:
+        concurrent.futures.TimeoutError: If no result arrives in `timeout`,
+            or right away while the FAQ is still loading.
+        queue.Full: If the embedding service is saturated.
+    """
+    _check_faq_ready()
+    faq_index = get_index('faq')
+    entries = _entries['faq']
+    idx, score = faq_index.search_async(question, get_embedding_service()).result(timeout)
+    if idx is None or idx >= len(entries):
+        return None, score
+    return entries[idx]['answer'], score
+
+
+def faq_search(question, top_k=3, threshold=SIMILARITY_THRESHOLD, timeout=FAQ_MATCH_TIMEOUT):
+    """
+    Finds the FAQ entries closest to `question`, encoding it on the
+    background embedding service like faq_answer().
+
+    Returns:
+        list: Up to `top_k` {"id", "question", "answer", "score"} dicts
+        scoring at least `threshold`, best first.
+    """
+    _check_faq_ready()
+    faq_index = get_index('faq')
+    entries = _entries['faq']
+    embedding = get_embedding_service().submit(question).result(timeout)
+    matches = faq_index.rank(embedding[None, :], top_k, threshold)[0]
+    return [{"id": entries[idx]["id"], "question": entries[idx]["question"],
+             "answer": entries[idx]["answer"], "score": round(score, 4)}
+            for idx, score in matches if idx < len(entries)]
+
+
 def get_faqs(file_name: str):
-    with open(file_name, 'r') as file:
-        data = json.load(file)
+    """
+    Loads the FAQ ('faq.json' / 'faq') or the rejected questions
+    ('rejected_faq.json' / 'rejected_faq') from the FAQ store and brings the
+    matching index up to date.
+    """
     key = file_name.split('.')[0]
-    q_list = [x['question'] for x in data[key]]
-    ans_list = [x['answer'] for x in data[key]]
-    return data['faq'], q_list, ans_list
+    entries = get_store().entries(key)
+    q_list = [x['question'] for x in entries]
+    ans_list = [x['answer'] for x in entries]
 
+    sync_index(file_name, q_list)
+    _entries[key] = entries
+    return entries, q_list, ans_list
 
-def add_rejected_question(rejected_question, answer):
-    rejected_file = 'rejected_faq.json'
-    idx_faq = -1
 
-    if os.path.exists(rejected_file):
-        with open(rejected_file, 'r') as file:
-            rejected_data = json.load(file)
-    else:
-        rejected_data = {"rejected_faq": []}
+def reload_indexes():
+    """
+    Re-reads every loaded FAQ table from the store and brings its index up
+    to date, memory-mapping the sidecar another process wrote when there is
+    one.
+    """
+    for key in list(_indexes):
+        get_faqs(key)
+        _indexes[key].memory_map()
 
-    if len(rejected_data["rejected_faq"]) > 0:
-        rej_qlist = [x["question"] for x in rejected_data["rejected_faq"]]
-        idx, corr = compute_similarity(rejected_question, rej_qlist)
-    else:
-        idx = None
 
-    if idx == None:
-        rejected_data["rejected_faq"].append(
-            {"question": rejected_question, "answer": answer, "frequency": 1}
-        )
-    else:
-        rejected_data["rejected_faq"][idx]["frequency"] += 1
-        if rejected_data["rejected_faq"][idx]["frequency"] >= 3:
-            idx_faq = idx
+def add_rejected_question(rejected_question, answer):
+    """
+    Records a question the FAQ could not answer, with the answer a human
+    gave. Nothing is encoded here; process_rejections() later merges it
+    with similar rejections and promotes it once asked often enough.
 
-    with open(rejected_file, 'w') as file:
-        json.dump(rejected_data, file, indent=4)
+    Returns:
+        int: Id of the rejected question.
+    """
+    return get_store().add_rejected(rejected_question, answer)
 
-    return idx_faq
 
+def process_rejections(threshold=SIMILARITY_THRESHOLD):
+    """
+    Clusters the rejected questions recorded since the last run and
+    promotes the clusters asked PROMOTION_FREQUENCY times to the FAQ.
 
-def remove_rejected_question(idx_faq, q_list, ans_list):
-    file_name = 'rejected_faq.json'
+    The new rejections are encoded in one batch (syncing the rejected index
+    only encodes rows appended since it was last synced) and scored against
+    every rejection with one matrix product. Each new one joins the cluster
+    of the most similar earlier rejection, adding its frequency, or starts
+    a new cluster.
 
-    with open(file_name, 'r') as file:
-        data = json.load(file)
+    Returns:
+        list: The {"question", "answer"} entries promoted to the FAQ, or an
+        empty list if there was nothing to do or another process handled
+        the same rejections first.
+    """
+    entries, _, _ = get_faqs('rejected_faq')
+    pending = [position for position, entry in enumerate(entries) if not entry['clustered']]
+    if not pending:
+        return []
+
+    rejected_index = get_index('rejected_faq')
+    embeddings = rejected_index.embeddings
+    similarity = dot(dequantize(embeddings[pending]), embeddings)
+
+    # Position of the cluster (its first rejection) every rejection is in
+    cluster = list(range(len(entries)))
+    added = {}
+    merged = []
+    for row, position in enumerate(pending):
+        # Only earlier rejections, a cluster is named after its oldest one
+        scores = similarity[row, :position]
+        if not len(scores):
+            continue
+        best = int(scores.argmax())
+        if scores[best] < threshold:
+            continue
+        target = cluster[best]
+        cluster[position] = target
+        added[entries[target]['id']] = added.get(entries[target]['id'], 0) + entries[position]['frequency']
+        merged.append(position)
+
+    result = get_store().cluster_rejected([entries[position]['id'] for position in pending],
+                                          [entries[position]['id'] for position in merged],
+                                          added, PROMOTION_FREQUENCY)
+    if result is None:
+        return []
+
+    promoted_ids = {entry['id'] for entry in result}
+    removed = merged + [position for position, entry in enumerate(entries) if entry['id'] in promoted_ids]
+    if removed:
+        rejected_index.remove(*removed)
+    get_faqs('rejected_faq')
+    if result and 'faq' in _indexes:
+        get_faqs('faq')
+    return [{"question": entry['question'], "answer": entry['answer']} for entry in result]
+
+
+def run_faq_jobs():
+    """
+    One round of the periodic FAQ work: picks up FAQ entries other
+    processes added and clusters/promotes the new rejections.
+    """
+    if 'faq' in _indexes:
+        get_faqs('faq')
+    return process_rejections()
 
-    rez = data["rejected_faq"][idx_faq]
-    del rez["frequency"]
-    add_faq(rez)
-    q_list.append(rez["question"])
-    ans_list.append(rez["answer"])
-    data["rejected_faq"].pop(idx_faq)
 
-    with open(file_name, 'w') as file:
-        json.dump(data, file, indent=4)
+def start_faq_jobs(interval):
+    """
+    Runs run_faq_jobs() every `interval` seconds on a daemon thread. Only
+    the first call in a process starts the thread.
+    """
+    global _jobs_thread
+    with _store_lock:
+        if _jobs_thread is not None:
+            return
+        _jobs_thread = threading.Thread(target=_faq_jobs_loop, args=(interval,), name='faq-jobs', daemon=True)
+        _jobs_thread.start()
 
 
-def add_faq(rez):
+def _faq_jobs_loop(interval):
+    while not _jobs_stopped.wait(interval):
+        try:
+            promoted = run_faq_jobs()
+            if promoted:
+                logger.info("Promoted %d rejected questions to the FAQ", len(promoted))
+        except Exception:
+            # Try again next round, the rejections stay queued
+            logger.exception("FAQ background job failed")
 
-    file_name = 'faq.json'
 
-    with open(file_name, 'r') as file:
-        data = json.load(file)
+def add_faq(rez):
+    # Re-reading the table only encodes the rows appended since the last
+    # sync, including ones added by other processes
+    if get_store().add_faq(rez["question"], rez["answer"]) and 'faq' in _indexes:
+        get_faqs('faq')
 
-    if isinstance(data["faq"], list) and rez not in data["faq"]:
-        data["faq"].append(rez)
 
-    with open(file_name, 'w') as file:
-        json.dump(data, file, indent=4)
+def read_questions(file):
+    """
+    Reads questions from a JSONL file, one JSON string or
+    {"question": ...} object per line. Blank lines are skipped.
+    """
+    for line in file:
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        yield entry["question"] if isinstance(entry, dict) else entry
+
+
+def batch_main(args):
+    faqs, question_list, answer_list = get_faqs(args.faq)
+
+    input_file = sys.stdin if args.batch == '-' else open(args.batch, 'r')
+    try:
+        results = match_many(read_questions(input_file), top_k=args.top_k, threshold=args.threshold,
+                             batch_size=args.batch_size, file_name=args.faq)
+        for question, matches in results:
+            print(json.dumps({
+                "question": question,
+                "matches": [
+                    {"index": idx, "question": question_list[idx], "answer": answer_list[idx], "score": round(score, 4)}
+                    for idx, score in matches
+                ],
+            }), flush=True)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Match student questions against the FAQ.")
+    parser.add_argument('--faq', default='faq', choices=['faq', 'rejected_faq'],
+                        help="FAQ table to match against in batch mode")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="Match questions from a JSONL file ('-' for stdin) instead of the interactive loop")
+    parser.add_argument('--top-k', type=int, default=3, help="Matches returned per question in batch mode")
+    parser.add_argument('--threshold', type=float, default=SIMILARITY_THRESHOLD,
+                        help="Minimum similarity for a match in batch mode")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Questions encoded per model call")
+    return parser.parse_args()
 
 
 def main():
-    faqs, question_list, answer_list = get_faqs("faq.json")
+    args = parse_args()
+    if args.batch:
+        batch_main(args)
+        return
+
+    faqs, question_list, answer_list = get_faqs("faq")
+    faq_index = get_index("faq")
 
     while True:
         question = input()
@@ -108,15 +877,16 @@ def main():
         if question == "exit":
             break
 
-        best_match_idx, corr = compute_similarity(question, question_list)
+        best_match_idx, corr = compute_similarity(question, faq_index)
         try:
             print(f"{corr:.2f}\n{answer_list[best_match_idx]}")
         except TypeError:
             print(f"{corr:.2f}\nNo match found\nHuman answer: ", end="")
             human_answer = input()
-            idx_faq = add_rejected_question(question, human_answer)
-            if idx_faq != -1:
-                remove_rejected_question(idx_faq, question_list, answer_list)
+            add_rejected_question(question, human_answer)
+            for entry in process_rejections():
+                question_list.append(entry["question"])
+                answer_list.append(entry["answer"])
 
 
 if __name__ == "__main__":
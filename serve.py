@@ -0,0 +1,214 @@
+"""
+Pre-fork server for the app.
+
+The master process creates the tables, loads the SBERT model and the FAQ
+embeddings, then forks SERVER_WORKERS workers that accept connections on
+one shared socket, each serving requests on threads. Everything the
+master loaded is shared with the workers: the model weights copy-on-write,
+the embedding matrices through the memory-mapped sidecar files.
+
+Signals sent to the master:
+    SIGHUP   reload the FAQ from the database; the master encodes new
+             questions once, the workers map the new matrix
+    SIGTERM  stop: workers finish the requests they are serving
+    SIGINT   same as SIGTERM
+
+Workers that die are replaced. With more than one worker, notifications
+go through the local broker so they reach streams served by any worker.
+Run from the repository root:
+    python serve.py [--host 0.0.0.0] [--port 8000] [--workers 4]
+
+Other WSGI servers can use the factory, loading it in their master
+process. Each open notification stream holds a thread, so they need a
+threaded worker class, and the local broker so notifications reach every
+worker, e.g.
+    FLASK_NOTIFICATION_BROKER=local \
+        gunicorn --preload -k gthread -w 4 --threads 32 'serve:create_app()'
+gunicorn's default sync workers serve one request at a time: a few open
+dashboards would take all of them.
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+
+def create_app():
+    """
+    Returns the Flask app with its tables created and the SBERT model and
+    FAQ index loaded, ready to be forked.
+
+    Nothing that starts threads or processes runs here: the FAQ jobs, the
+    embedding service and the process pools all start on first use, in
+    the workers.
+    """
+    import app as A
+    import sbert_similarity
+
+    with A.app.app_context():
+        A.db.create_all()
+        A.fail_interrupted_subject_changes()
+        # Connections opened here must not be shared with the workers
+        A.db.engine.dispose()
+    sbert_similarity.warm_up()
+    return A.app
+
+
+def before_fork():
+    import app as A
+    import sbert_similarity
+
+    with A.app.app_context():
+        A.db.engine.dispose()
+    sbert_similarity.get_store().close()
+
+
+def run_worker(app, listener, threads_per_worker):
+    """
+    Serves requests from `listener` until SIGTERM, then finishes the
+    requests in flight. SIGHUP reloads the FAQ index.
+    """
+    import app as A
+    import sbert_similarity
+
+    if 'torch' in sys.modules:
+        # Workers share the cores, each model call gets its share of them
+        sys.modules['torch'].set_num_threads(threads_per_worker)
+
+    server = make_server(listener.getsockname()[0], listener.getsockname()[1], app, threaded=True,
+                         fd=listener.fileno())
+    # Join request threads on shutdown instead of dropping them
+    server.daemon_threads = False
+    server.block_on_close = True
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever(), which runs on this thread
+        threading.Thread(target=server.shutdown).start()
+        # Notification streams never finish on their own
+        threading.Thread(target=A.close_notification_broker).start()
+
+    def reload(signum, frame):
+        threading.Thread(target=sbert_similarity.reload_indexes, name='faq-reload').start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, reload)
+    server.serve_forever()
+    server.server_close()
+
+
+class Master:
+    """
+    Forks the workers and keeps `count` of them running.
+    """
+
+    def __init__(self, app, listener, count, graceful_timeout):
+        self.app = app
+        self.listener = listener
+        self.count = count
+        self.graceful_timeout = graceful_timeout
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // count)
+        self.workers = set()
+        self.stopping = False
+        self.reloading = False
+
+    def spawn(self):
+        before_fork()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.app, self.listener, self.threads_per_worker)
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+                status = 1
+            finally:
+                os._exit(status)
+        self.workers.add(pid)
+
+    def signal_workers(self, signum):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+            if not self.stopping:
+                print(f"Worker {pid} exited ({status}), starting a new one", file=sys.stderr)
+
+    def reload(self):
+        import sbert_similarity
+
+        start = time.perf_counter()
+        # Encodes the new questions once and writes the sidecar, so the
+        # workers only have to map it
+        sbert_similarity.reload_indexes()
+        self.signal_workers(signal.SIGHUP)
+        print(f"Reloaded the FAQ index in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    def run(self):
+        def stop(signum, frame):
+            self.stopping = True
+
+        def reload(signum, frame):
+            self.reloading = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, reload)
+
+        while not self.stopping:
+            self.reap()
+            while len(self.workers) < self.count and not self.stopping:
+                self.spawn()
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            time.sleep(0.2)
+
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        self.signal_workers(signal.SIGKILL)
+        self.reap()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with pre-forked worker processes.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, help="Worker processes (default SERVER_WORKERS)")
+    args = parser.parse_args()
+
+    app = create_app()
+    workers = args.workers or app.config['SERVER_WORKERS']
+    if workers > 1 and app.config['NOTIFICATION_BROKER'] == 'memory':
+        # A notification has to reach the stream whichever worker serves it
+        app.config['NOTIFICATION_BROKER'] = 'local'
+    listener = socket.create_server((args.host, args.port), backlog=2048)
+    print(f"Serving on http://{args.host}:{args.port} with {workers} workers (master {os.getpid()})",
+          file=sys.stderr)
+    Master(app, listener, workers, app.config['SERVER_GRACEFUL_TIMEOUT']).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import os
+import numpy as np
+
+# Ways the embedding matrix can be stored. float16 halves it, int8 quarters
+# it: components of a normalized embedding are stored as multiples of
+# INT8_MAX_VALUE / 127, clipped to +-INT8_MAX_VALUE (larger components are
+# very rare in a few hundred dimensions)
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+INT8_MAX_VALUE = 0.5
+# Stored rows converted back to float32 at a time while scoring
+SCORE_BLOCK_ROWS = 16384
+
+
+def quantize(embeddings, dtype):
+    """
+    Converts normalized float32 embeddings to the storage `dtype`.
+    """
+    if dtype == 'int8':
+        scaled = np.rint(np.asarray(embeddings) * (127 / INT8_MAX_VALUE))
+        return np.clip(scaled, -127, 127).astype(np.int8)
+    return np.asarray(embeddings, dtype=dtype)
+
+
+def dequantize(embeddings):
+    """
+    Returns stored embeddings as float32, undoing quantize().
+    """
+    if embeddings.dtype == np.int8:
+        return embeddings.astype(np.float32) * (INT8_MAX_VALUE / 127)
+    return np.asarray(embeddings, dtype=np.float32)
+
+
+def dot(queries, embeddings):
+    """
+    queries @ embeddings.T for float32 queries against embeddings stored in
+    any of STORAGE_DTYPES. A compact matrix is converted SCORE_BLOCK_ROWS
+    rows at a time, never expanded whole.
+    """
+    if embeddings.dtype == np.float32:
+        return queries @ embeddings.T
+    scores = np.empty((len(queries), len(embeddings)), dtype=np.float32)
+    for start in range(0, len(embeddings), SCORE_BLOCK_ROWS):
+        block = embeddings[start:start + SCORE_BLOCK_ROWS]
+        scores[:, start:start + len(block)] = queries @ dequantize(block).T
+    return scores
+
+
+def _top_k(scores, top_k):
+    """
+    Returns the indices and values of the `top_k` largest entries of every
+    row of `scores`, best first.
+    """
+    top_k = min(top_k, scores.shape[1])
+    if top_k < scores.shape[1]:
+        indices = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    else:
+        indices = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+    values = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(values, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class BruteForceBackend:
+    """
+    Exact search: scores every stored embedding for every query.
+    """
+
+    name = 'brute'
+
+    def __init__(self):
+        self.embeddings = None
+
+    def build(self, embeddings):
+        self.embeddings = embeddings
+
+    def add(self, embeddings):
+        # The owning index already holds the grown matrix, just point at it
+        self.embeddings = embeddings
+
+    def remove(self, idx, embeddings):
+        self.embeddings = embeddings
+
+    def search(self, queries, top_k):
+        """
+        Args:
+            queries (np.ndarray): Normalized query embeddings, one per row.
+            top_k (int): Number of neighbours per query.
+
+        Returns:
+            tuple: (scores, indices) arrays of shape (len(queries), top_k).
+        """
+        return _top_k(dot(queries, self.embeddings), top_k)
+
+
+class IVFBackend:
+    """
+    Approximate search with an inverted file index.
+
+    The embeddings are clustered with spherical k-means and every query only
+    scores the members of its `n_probe` closest clusters. Raising `n_probe`
+    trades latency for recall; `n_probe == n_lists` is an exact search.
+    """
+
+    name = 'ivf'
+
+    def __init__(self, n_lists=None, n_probe=8, min_rows=2048, iterations=10, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.min_rows = min_rows
+        self.iterations = iterations
+        self.seed = seed
+        self.embeddings = None
+        self.centroids = None
+        self.lists = []
+        self.trained_rows = 0
+
+    def _train(self):
+        count = len(self.embeddings)
+        self.trained_rows = count
+        if count < self.min_rows:
+            self.centroids, self.lists = None, []
+            return
+
+        n_lists = self.n_lists or max(1, int(np.sqrt(count)))
+        rng = np.random.default_rng(self.seed)
+        sample = dequantize(self.embeddings[rng.choice(count, size=min(count, 64 * n_lists), replace=False)])
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignment = (sample @ centroids.T).argmax(axis=1)
+            for cluster in range(n_lists):
+                members = sample[assignment == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        centroids = centroids.astype(np.float32)
+        assignment = self._assign(self.embeddings, centroids)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        # Swapped in together, a search never sees new centroids with old lists
+        self.centroids, self.lists = centroids, [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+    def _assign(self, embeddings, centroids=None, chunk_size=8192):
+        centroids = self.centroids if centroids is None else centroids
+        return np.concatenate([
+            dot(dequantize(embeddings[start:start + chunk_size]), centroids).argmax(axis=1)
+            for start in range(0, len(embeddings), chunk_size)
+        ]) if len(embeddings) else np.empty(0, dtype=np.int64)
+
+    def build(self, embeddings):
+        self.embeddings = embeddings
+        self._train()
+
+    def add(self, embeddings):
+        start = len(self.embeddings) if self.embeddings is not None else 0
+        self.embeddings = embeddings
+
+        # Clusters drift as the corpus grows, retrain once it has doubled
+        if self.centroids is None or len(embeddings) >= 2 * self.trained_rows:
+            if len(embeddings) >= self.min_rows or self.centroids is not None:
+                self._train()
+            return
+
+        new_ids = np.arange(start, len(embeddings))
+        for idx, cluster in zip(new_ids, self._assign(embeddings[start:])):
+            self.lists[cluster] = np.append(self.lists[cluster], idx)
+
+    def remove(self, idx, embeddings):
+        self.embeddings = embeddings
+        if self.centroids is None:
+            return
+        for cluster, members in enumerate(self.lists):
+            members = members[members != idx]
+            self.lists[cluster] = np.where(members > idx, members - 1, members)
+
+    def search(self, queries, top_k):
+        """
+        Args:
+            queries (np.ndarray): Normalized query embeddings, one per row.
+            top_k (int): Number of neighbours per query.
+
+        Returns:
+            tuple: (scores, indices) arrays of shape (len(queries), top_k).
+            Rows are padded with -inf / -1 when the probed clusters hold
+            fewer than `top_k` members.
+        """
+        if self.centroids is None:
+            return _top_k(dot(queries, self.embeddings), top_k)
+
+        n_probe = min(self.n_probe, len(self.lists))
+        _, probes = _top_k(queries @ self.centroids.T, n_probe)
+
+        scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), top_k), -1, dtype=np.int64)
+        for row, (query, clusters) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([self.lists[cluster] for cluster in clusters])
+            if not len(candidates):
+                continue
+            found_scores, found = _top_k(dot(query[None, :], self.embeddings[candidates]), top_k)
+            scores[row, :found.shape[1]] = found_scores[0]
+            indices[row, :found.shape[1]] = candidates[found[0]]
+        return scores, indices
+
+
+BACKENDS = {
+    BruteForceBackend.name: BruteForceBackend,
+    IVFBackend.name: IVFBackend,
+}
+
+
+def make_backend(name=None, **options):
+    """
+    Creates a similarity backend by name.
+
+    The name defaults to the FAQ_INDEX_BACKEND environment variable
+    ('brute' when unset); the IVF probe count can also be set with
+    FAQ_INDEX_NPROBE.
+    """
+    name = name or os.environ.get('FAQ_INDEX_BACKEND', BruteForceBackend.name)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown similarity backend '{name}', expected one of {sorted(BACKENDS)}")
+    if name == IVFBackend.name and 'n_probe' not in options and 'FAQ_INDEX_NPROBE' in os.environ:
+        options['n_probe'] = int(os.environ['FAQ_INDEX_NPROBE'])
+    return BACKENDS[name](**options)
@@ -0,0 +1,121 @@
+"""
+The dashboard pages must issue the same number of SQL queries however much
+data there is; a count that grows with the data is an N+1 query.
+
+Every page is requested twice per size: the first request loads the
+logged-in user, the second finds it in the user cache and only checks
+that it still exists.
+
+The database is a throwaway SQLite file, the app's own is never touched.
+Run from the repository root:
+    python -m pytest tests/test_query_count.py
+"""
+import os
+import tempfile
+
+import pytest
+
+SIZES = (10, 100, 1000)
+PASSWORD = 'password1'
+
+WORKDIR = tempfile.mkdtemp(prefix='test-queries-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORKDIR, 'test.db')}"
+os.environ['FLASK_PDF_CACHE_DIR'] = os.path.join(WORKDIR, 'pdf_cache')
+os.environ['FLASK_DOCUMENTS_DIR'] = os.path.join(WORKDIR, 'documents')
+os.environ['FLASK_FAQ_JOBS_INTERVAL'] = '0'
+
+from sqlalchemy import event  # noqa: E402
+
+import app as A  # noqa: E402
+
+
+def seed(size, password_hash):
+    """
+    Creates `size` students and size / 10 employees. The measured student
+    and employee have data proportional to `size` too.
+    """
+    A.db.drop_all()
+    A.db.create_all()
+    db = A.db
+
+    admin = A.User(username='admin1', password=password_hash, role='admin')
+    db.session.add(admin)
+
+    employees = []
+    for i in range(max(1, size // 10)):
+        user = A.User(username=f'employee{i}', password=password_hash, role='employee')
+        employees.append(A.Employee(user=user))
+    courses = [A.Course(name=f'Course {i}', teacher=f'Teacher {i}') for i in range(max(1, size // 10))]
+    db.session.add_all(employees + courses)
+
+    for i in range(size):
+        user = A.User(username=f'student{i}', password=password_hash, role='student')
+        student = A.Student(user=user, name=f'Student {i}', address='Address', group=f'3{i % 10}1CA')
+        db.session.add(student)
+        for course in courses[:3] if i else courses:
+            student.enrollments.append(A.Enrollment(course=course))
+            student.grade_entries.append(A.Grade(course=course, value=10))
+        for j in range(3 if i else size):
+            employee = employees[0] if i == 0 else employees[(i + j) % len(employees)]
+            question = A.Question(text=f'Question {j}', student=student, employee=employee)
+            if j % 2:
+                question.status, question.answer = 'answered', 'Answer'
+                question.answered_at = question.created_at = A.datetime.utcnow()
+            db.session.add(question)
+    db.session.commit()
+
+
+PAGES = {
+    'student0': ['/dashboard', '/inbox', '/student/1', '/subject_change'],
+    'employee0': ['/employee_dashborad'],
+    'admin1': ['/admin_dashboard'],
+}
+
+
+def count_queries(client, engine, url):
+    queries = []
+
+    def record(conn, cursor, statement, *args):
+        queries.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+    assert response.status_code == 200, (url, response.status_code)
+    return len(queries)
+
+
+@pytest.fixture(scope='module')
+def query_counts():
+    """
+    {url: {size: (queries with a cold user cache, queries with a cached user)}}
+    """
+    A.app.config['WTF_CSRF_ENABLED'] = False
+    with A.app.app_context():
+        engine = A.db.engine
+        # Hash once, bcrypt would dominate seeding otherwise
+        password_hash = A.bcrypt.generate_password_hash(PASSWORD)
+
+    counts = {}
+    for size in SIZES:
+        # Requests run outside of this context, each gets a fresh session
+        with A.app.app_context():
+            seed(size, password_hash)
+        A.user_cache.clear()
+        for username, urls in PAGES.items():
+            client = A.app.test_client()
+            client.post('/login', data={'username': username, 'password': PASSWORD})
+            for url in urls:
+                cold = count_queries(client, engine, url)
+                warm = count_queries(client, engine, url)
+                counts.setdefault(url, {})[size] = (cold, warm)
+            A.user_cache.clear()
+    return counts
+
+
+@pytest.mark.parametrize('url', [url for urls in PAGES.values() for url in urls])
+def test_query_count_is_constant(query_counts, url):
+    by_size = query_counts[url]
+    assert len(set(by_size.values())) == 1, f"Query count of {url} grows with the data: {by_size}"